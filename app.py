@@ -3,12 +3,22 @@ import os
 from dotenv import load_dotenv
 from model import LLMHandler
 from document import DocumentProcessor
+from doc_store import DocumentStore
+from summarize import Summarizer
+from ingest import IngestJob, ingest_file, QUEUED, PROCESSING, DONE, FAILED, CANCELLED
+from embeddings import HashingEmbedder, SentenceTransformerEmbedder
+from response_cache import ResponseCache
+from conversation_store import ConversationStore
+from message_log import USER, ASSISTANT
+from export import iter_export, import_conversations, create_download_link, EXPORT_LINK_TTL
+from metrics import get_metrics, start_metrics_server
+from jobs import GenerationJob
 import traceback
-import base64
 from datetime import datetime
-import json
+from collections import OrderedDict
 import uuid
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+import functools
+import time
 
 # Load environment variables from .env file
 load_dotenv()
@@ -102,10 +112,75 @@ def apply_custom_css():
     </style>
     """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_document_processor():
+    """Document processor shared by all sessions (it holds no per-user state)."""
+    return DocumentProcessor()
+
+@st.cache_resource
+def get_document_store():
+    """Document text cache shared by every session in this process."""
+    max_mb = int(os.getenv("DOC_CACHE_MAX_MB", 64))
+    persist_dir = os.getenv("DOC_CACHE_DIR") or None
+    return DocumentStore(max_bytes=max_mb * 1024 * 1024, persist_dir=persist_dir)
+
+@st.cache_resource
+def get_summary_store():
+    """Document digests by content hash, shared by every session in this process."""
+    max_mb = int(os.getenv("SUMMARY_CACHE_MAX_MB", 8))
+    persist_dir = os.getenv("SUMMARY_CACHE_DIR") or None
+    return DocumentStore(max_bytes=max_mb * 1024 * 1024, persist_dir=persist_dir)
+
+@st.cache_resource
+def get_embedder():
+    """Embedder for dense retrieval, or None to use keyword (BM25) retrieval."""
+    model_name = os.getenv("EMBEDDING_MODEL")
+    if not model_name:
+        return None
+    if model_name == "hashing":
+        return HashingEmbedder()
+    return SentenceTransformerEmbedder(model_name)
+
+@st.cache_resource
+def get_response_cache():
+    """Response cache shared by every session, or None if disabled."""
+    if os.getenv("RESPONSE_CACHE", "on").lower() in ("0", "off", "false"):
+        return None
+    threshold = os.getenv("RESPONSE_CACHE_SIMILARITY")
+    return ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024)),
+        ttl=int(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+        persist_path=os.getenv("RESPONSE_CACHE_PATH") or None,
+        embedder=(get_embedder() or HashingEmbedder()) if threshold else None,
+        similarity_threshold=float(threshold) if threshold else 0.95,
+    )
+
+@st.cache_resource
+def get_conversation_store():
+    """Saved conversations database, shared by every session in this process."""
+    return ConversationStore(os.getenv("CONVERSATION_DB", "conversations.db"))
+
+def conversation_store():
+    """This session's view of the saved conversations; other sessions' are hidden."""
+    return get_conversation_store().for_owner(st.session_state.history_owner)
+
+# Number of saved conversations shown per page in the History tab
+HISTORY_PAGE_SIZE = 10
+
+# Number of recently used saved conversations kept in memory per session for instant switching
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", 8))
+
+# Number of most recent chat messages rendered; "Load earlier" shows this many more
+CHAT_WINDOW_SIZE = int(os.getenv("CHAT_WINDOW_SIZE", 50))
+
+# Seconds between refreshes of a reply while it is being generated
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", 0.1))
+
+# Seconds between progress refreshes while uploaded documents are being processed
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 0.5))
+
 def initialize_session_state():
     """Initialize session state variables if they don't exist."""
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
     if "current_model" not in st.session_state:
         st.session_state.current_model = os.getenv("DEFAULT_MODEL", "Llama3-8b")
     if "temperature" not in st.session_state:
@@ -116,92 +191,195 @@ def initialize_session_state():
         st.session_state.system_prompt = "You are a helpful assistant."
     if "context_docs" not in st.session_state:
         st.session_state.context_docs = {}
+    if "doc_indexes" not in st.session_state:
+        st.session_state.doc_indexes = {}
+    if "doc_summaries" not in st.session_state:
+        st.session_state.doc_summaries = {}
+    if "summarize_docs" not in st.session_state:
+        st.session_state.summarize_docs = os.getenv("DOC_SUMMARIES", "on").lower() not in ("0", "off", "false")
     if "llm_handler" not in st.session_state:
         st.session_state.llm_handler = LLMHandler()
-    if "doc_processor" not in st.session_state:
-        st.session_state.doc_processor = DocumentProcessor()
+        st.session_state.llm_handler.response_cache = get_response_cache()
     if "model_initialized" not in st.session_state:
         st.session_state.model_initialized = False
-    if "conversation_history" not in st.session_state:
-        st.session_state.conversation_history = {}
+    if "history_page" not in st.session_state:
+        st.session_state.history_page = 0
+    if "chat_window" not in st.session_state:
+        st.session_state.chat_window = CHAT_WINDOW_SIZE
+    if "history_owner" not in st.session_state:
+        # History is private to the browser session unless sharing it is turned on
+        shared = os.getenv("SHARED_HISTORY", "off").lower() in ("1", "on", "true")
+        st.session_state.history_owner = "" if shared else str(uuid.uuid4())
     if "current_conversation_id" not in st.session_state:
         st.session_state.current_conversation_id = str(uuid.uuid4())
+    if "conversation_snapshots" not in st.session_state:
+        st.session_state.conversation_snapshots = OrderedDict()
+    if "export_links" not in st.session_state:
+        st.session_state.export_links = {}
+    if "generation" not in st.session_state:
+        st.session_state.generation = None
+    if "ingest_jobs" not in st.session_state:
+        st.session_state.ingest_jobs = []
+    if "ingested_file_ids" not in st.session_state:
+        st.session_state.ingested_file_ids = set()
+
+def chat_messages():
+    """The current conversation's message log, shared with the LLM handler."""
+    return st.session_state.llm_handler.message_log
+
+def stash_conversation():
+    """Keep the current conversation in memory so switching back to it is instant.
+
+    Only conversations that are in the store (and so can be reopened from
+    the History tab) are kept, up to CONVERSATION_CACHE_SIZE of them.
+    """
+    handler = st.session_state.llm_handler
+    if handler.message_log.saved_version is None:
+        return
+    snapshots = st.session_state.conversation_snapshots
+    snapshots[st.session_state.current_conversation_id] = handler.snapshot()
+    snapshots.move_to_end(st.session_state.current_conversation_id)
+    while len(snapshots) > CONVERSATION_CACHE_SIZE:
+        snapshots.popitem(last=False)
+
+def finish_generation(stop=False):
+    """Drop the current generation job once it's done (or, with stop, stop it first).
+
+    Stopping waits for the job's task to finish, which cancellation makes
+    quick, so the handler is never used for a new turn while the old one
+    is still writing to it. The stopped reply lands in the conversation it
+    was started in.
+    """
+    job = st.session_state.generation
+    if job is None:
+        return
+    if stop:
+        job.cancel()
+        job.wait()
+    elif not job.done:
+        return
+    if job.error:
+        # Add error message to chat
+        chat_messages().append(ASSISTANT, job.error, {"error": True})
+    st.session_state.generation = None
+
+def show_generation():
+    """The turn being generated: the question, the reply so far and a Stop button."""
+    job = st.session_state.generation
+    if job is None:
+        return
+    with st.chat_message("user"):
+        st.write(job.user_input)
+    with st.chat_message("assistant"):
+        render_started_at = time.perf_counter()
+        response = job.text
+        if response:
+            st.markdown(format_markdown_content(response) + "▌")
+        else:
+            st.caption("Thinking...")
+        # Time spent redrawing the partial reply, apart from waiting on the model
+        get_metrics().observe("ui_render_seconds", time.perf_counter() - render_started_at, stage="stream")
+        st.button("⏹️ Stop", key="stop_generation", on_click=job.cancel, disabled=job.cancelled)
+    
+    # Once the reply is complete, rerun the whole app to show it in the history and stop polling
+    if job.done:
+        st.rerun()
 
 def clear_chat():
     """Clear the chat history and start a new conversation."""
-    st.session_state.messages = []
+    finish_generation(stop=True)
+    stash_conversation()
     st.session_state.llm_handler.reset_memory()
     st.session_state.current_conversation_id = str(uuid.uuid4())
+    st.session_state.chat_window = CHAT_WINDOW_SIZE
 
 def save_conversation():
     """Save the current conversation to conversation history."""
-    if not st.session_state.messages:
-        return "No messages to save."
+    messages = chat_messages()
+    if not messages:
+        return False
     
     conversation_id = st.session_state.current_conversation_id
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # Format the conversation title based on the first message
     title = f"Conversation {timestamp}"
-    if len(st.session_state.messages) > 0:
-        first_user_msg = next((msg for msg in st.session_state.messages if msg["role"] == "user"), None)
-        if first_user_msg:
-            # Use the first part of the first user message as title
-            title = first_user_msg["content"][:40] + ("..." if len(first_user_msg["content"]) > 40 else "")
-    
-    # Save to conversation history
-    st.session_state.conversation_history[conversation_id] = {
-        "id": conversation_id,
-        "title": title,
-        "timestamp": timestamp,
-        "messages": st.session_state.messages.copy(),
-        "model": st.session_state.current_model,
-        "temperature": st.session_state.temperature,
-        "max_tokens": st.session_state.max_tokens,
-        "system_prompt": st.session_state.system_prompt
-    }
+    first_user_msg = next((msg for msg in messages if msg.role == USER), None)
+    if first_user_msg:
+        # Use the first part of the first user message as title
+        title = first_user_msg.content[:40] + ("..." if len(first_user_msg.content) > 40 else "")
     
-    # Create a download link for backup
-    content = json.dumps({
+    # Save to the conversation store; only turns added since the last save are written
+    start = messages.saved_count if messages.saved_version is not None else 0
+    conversation_store().save({
         "id": conversation_id,
         "title": title,
         "timestamp": timestamp,
-        "messages": st.session_state.messages,
         "model": st.session_state.current_model,
         "temperature": st.session_state.temperature,
         "max_tokens": st.session_state.max_tokens,
         "system_prompt": st.session_state.system_prompt
-    }, indent=2)
-    
-    filename = f"conversation_{timestamp.replace(':', '-').replace(' ', '_')}.json"
-    b64 = base64.b64encode(content.encode()).decode()
-    download_link = f'<a href="data:file/json;base64,{b64}" download="{filename}">Download conversation backup</a>'
-    
-    return download_link
+    }, messages, start=start)
+    messages.mark_saved()
+    return True
+
+def export_url(key, conversation_ids=None):
+    """URL the metrics server streams a gzip JSONL export from, or None to use a download button.
+
+    Only used when EXPORT_BASE_URL says where browsers can reach the
+    metrics server; METRICS_PORT alone may just be for scraping, and a
+    localhost URL would only work on the server itself. Links are reused
+    across reruns until they are close to expiring.
+    """
+    base_url = os.getenv("EXPORT_BASE_URL")
+    if not base_url or not os.getenv("METRICS_PORT"):
+        return None
+    links = st.session_state.export_links
+    link = links.get(key)
+    if link is None or link[0] != conversation_ids or link[2] < time.time() + 60:
+        path = create_download_link(conversation_store(), conversation_ids)
+        link = links[key] = (conversation_ids, path, time.time() + EXPORT_LINK_TTL)
+    return base_url.rstrip("/") + link[1]
+
+def show_export(label, key, file_name, conversation_ids=None):
+    """Download control for saved conversations as gzip-compressed JSONL."""
+    url = export_url(key, conversation_ids)
+    if url:
+        st.markdown(f'<a href="{url}" download="{file_name}">{label}</a>', unsafe_allow_html=True)
+    else:
+        # Without the HTTP endpoint the export is built in memory, but only when clicked
+        store = conversation_store()
+        st.download_button(
+            label,
+            data=lambda: b"".join(iter_export(store, conversation_ids, compress=True)),
+            file_name=file_name,
+            mime="application/gzip",
+            key=key,
+            use_container_width=True
+        )
 
 def load_conversation(conversation_id):
     """Load a conversation from history."""
-    if conversation_id in st.session_state.conversation_history:
-        conversation = st.session_state.conversation_history[conversation_id]
-        st.session_state.messages = conversation["messages"].copy()
+    store = conversation_store()
+    conversation = store.get(conversation_id)
+    if conversation:
+        handler = st.session_state.llm_handler
+        if conversation_id != st.session_state.current_conversation_id:
+            finish_generation(stop=True)
+            stash_conversation()
+            # Swap in the in-memory copy if there is one, else read it from the store
+            snapshot = st.session_state.conversation_snapshots.pop(conversation_id, None)
+            if snapshot is not None:
+                handler.restore(snapshot)
+            else:
+                handler.load_messages(store.load_messages(conversation_id))
+                handler.message_log.mark_saved()
         st.session_state.current_model = conversation["model"]
         st.session_state.temperature = conversation["temperature"]
         st.session_state.max_tokens = conversation["max_tokens"]
         st.session_state.system_prompt = conversation["system_prompt"]
         st.session_state.current_conversation_id = conversation_id
-        st.session_state.llm_handler.reset_memory()
-        
-        # Rebuild the LLM handler's memory from the messages
-        for msg in st.session_state.messages:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            
-            if role == "system":
-                st.session_state.llm_handler.message_history.add_message(SystemMessage(content=content))
-            elif role == "user":
-                st.session_state.llm_handler.message_history.add_message(HumanMessage(content=content))
-            elif role == "assistant":
-                st.session_state.llm_handler.message_history.add_message(AIMessage(content=content))
+        st.session_state.chat_window = CHAT_WINDOW_SIZE
 
 def check_env_setup():
     """Check if the environment is properly configured."""
@@ -218,6 +396,152 @@ def format_markdown_content(content):
     # This function could be extended to enhance markdown rendering
     return content
 
+@functools.lru_cache(maxsize=2048)
+def render_markdown(content):
+    """Formatted markdown for a finished message, cached so reruns don't re-format it."""
+    return format_markdown_content(content)
+
+@st.cache_resource
+def start_metrics_export():
+    """Serve Prometheus metrics on METRICS_PORT, if set (once per process)."""
+    port = os.getenv("METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port))
+        except Exception as e:
+            print(f"Error starting metrics server: {str(e)}")
+
+def write_metrics_file():
+    """Write Prometheus metrics to METRICS_FILE, if set."""
+    path = os.getenv("METRICS_FILE")
+    if path:
+        try:
+            get_metrics().write_prometheus(path)
+        except Exception as e:
+            print(f"Error writing metrics file: {str(e)}")
+
+def show_diagnostics():
+    """Stage timings and counters recorded in this process."""
+    snapshot = get_metrics().snapshot()
+    if not snapshot["spans"]:
+        st.caption("No timings recorded yet.")
+        return
+    st.table([
+        {"stage": span["name"], "labels": ", ".join(f"{k}={v}" for k, v in span["labels"].items()),
+         "count": span["count"], "mean ms": round(span["mean_ms"], 1), "p95 ms": round(span["p95_ms"], 1)}
+        for span in snapshot["spans"]
+    ])
+    st.table([
+        {"counter": counter["name"], "labels": ", ".join(f"{k}={v}" for k, v in counter["labels"].items()),
+         "value": counter["value"]}
+        for counter in snapshot["counters"]
+    ])
+    st.caption(f"Scheduler: {st.session_state.llm_handler.scheduler.metrics()}")
+    prefix = st.session_state.llm_handler.prompt_assembler.stats()
+    if prefix["requests"]:
+        st.caption(f"Prompt prefix reuse: {prefix['reuse_ratio']:.0%} of {prefix['prompt_tokens']} prompt tokens "
+                   f"over {prefix['requests']} requests · fingerprint {prefix['last_fingerprint'][:12]}")
+
+def merge_ingest_results(jobs):
+    """Move documents and digests finished by ingestion jobs into session state."""
+    for job in jobs:
+        # Store the full text and the chunk index; each question then only pulls in the relevant chunks
+        for doc_name, doc_text, doc_index in job.drain():
+            st.session_state.context_docs[doc_name] = doc_text
+            st.session_state.doc_indexes[doc_name] = doc_index
+            # A re-uploaded document gets a new digest, if any
+            st.session_state.doc_summaries.pop(doc_name, None)
+        # Long documents also go into every request as a digest once it's written
+        for doc_name, doc_summary in job.drain_summaries():
+            if doc_name in st.session_state.context_docs:
+                st.session_state.doc_summaries[doc_name] = doc_summary
+
+def start_ingest(uploaded_files):
+    """Queue uploads that haven't been seen yet for concurrent processing.
+
+    Files stay in the uploader across reruns, so each one is only queued
+    the first time it appears.
+    """
+    new_files = [file for file in uploaded_files if file.file_id not in st.session_state.ingested_file_ids]
+    if not new_files:
+        return
+    st.session_state.ingested_file_ids.update(file.file_id for file in new_files)
+    # Drop finished batches, but only once everything they produced has been merged in.
+    # A batch done before the merge has nothing left to queue after it.
+    jobs = st.session_state.ingest_jobs
+    finished = [job for job in jobs if job.done]
+    merge_ingest_results(jobs)
+    st.session_state.ingest_jobs = [job for job in jobs if job not in finished]
+    # Shared resources are resolved here since worker threads have no Streamlit context
+    summarizer = None
+    if st.session_state.summarize_docs and st.session_state.model_initialized:
+        summarizer = Summarizer(st.session_state.llm_handler, get_document_processor(), get_summary_store())
+    process = functools.partial(
+        ingest_file, store=get_document_store(), processor=get_document_processor(),
+        embedder=get_embedder(), cache_dir=os.getenv("EMBEDDING_CACHE_DIR") or None
+    )
+    st.session_state.ingest_jobs.append(IngestJob(new_files, process, summarizer))
+
+def cancel_ingest():
+    for job in st.session_state.ingest_jobs:
+        job.cancel()
+
+def show_documents(polling):
+    """Ingestion progress and the active documents, merging in files as they finish."""
+    jobs = st.session_state.ingest_jobs
+    merge_ingest_results(jobs)
+    
+    if jobs:
+        statuses = [status for job in jobs for status in job.files]
+        finished = 0
+        for job in jobs:
+            counts = job.counts()
+            finished += counts[DONE] + counts[FAILED] + counts[CANCELLED]
+        st.progress(finished / len(statuses), text=f"Processed {finished} of {len(statuses)} files")
+        for status in statuses:
+            icon = {QUEUED: "⏳", PROCESSING: "⚙️", DONE: "✅", FAILED: "❌", CANCELLED: "⏹️"}[status.state]
+            timing = f" · {status.elapsed:.1f}s" if status.started_at is not None else ""
+            st.caption(f"{icon} {status.name} · {status.size / 1024:.0f} KB · {status.state}{timing}")
+            if status.state == FAILED:
+                st.error(f"Error processing {status.name}: {status.error}")
+        summarizing = sum(job.summarizing for job in jobs)
+        if summarizing:
+            st.caption(f"📝 Summarizing {summarizing} document(s); they can already be used")
+        if not all(job.done for job in jobs):
+            st.button("Cancel", key="cancel_ingest", on_click=cancel_ingest)
+    
+    # Once the batch is finished, rerun the whole app to stop polling
+    if polling and all(job.done for job in jobs):
+        st.rerun()
+    
+    # Display uploaded documents with improved styling
+    if st.session_state.context_docs:
+        st.subheader("Active Documents")
+        for doc_name in list(st.session_state.context_docs.keys()):
+            with st.container():
+                col1, col2 = st.columns([5, 1])
+                with col1:
+                    st.markdown(f"📄 **{doc_name}**")
+                    with st.expander("Preview"):
+                        st.markdown(st.session_state.context_docs[doc_name][:500] + "...")
+                    if doc_name in st.session_state.doc_summaries:
+                        with st.expander("Summary"):
+                            st.markdown(st.session_state.doc_summaries[doc_name])
+                with col2:
+                    if st.button("🗑️", key=f"remove_{doc_name}"):
+                        del st.session_state.context_docs[doc_name]
+                        st.session_state.doc_indexes.pop(doc_name, None)
+                        st.session_state.doc_summaries.pop(doc_name, None)
+                        st.rerun()
+
+def format_response_stats(stats):
+    """Format streaming latency stats for display under a reply."""
+    text = (f"First token in {stats['time_to_first_token']:.2f}s · "
+            f"{stats['tokens']} tokens at {stats['tokens_per_sec']:.1f} tokens/s")
+    if stats.get("truncated"):
+        text += " · stopped early"
+    return text
+
 def main():
     st.set_page_config(
         page_title="AI Chat Assistant", 
@@ -230,6 +554,8 @@ def main():
     apply_custom_css()
     
     initialize_session_state()
+    start_metrics_export()
+    metrics = get_metrics()
     
     # Check environment setup
     env_issues = check_env_setup()
@@ -327,6 +653,32 @@ def main():
                 help="Maximum number of tokens to generate"
             )
             
+            # Opt-in hedging: race a fallback model when the primary is slow to start
+            fallback_options = ["Off"] + [name for name in st.session_state.llm_handler.available_models
+                                          if name != st.session_state.current_model]
+            hedge_model = st.selectbox(
+                "Hedge slow replies with",
+                fallback_options,
+                help="If the selected model hasn't started answering by its usual (p95) "
+                     "time to first token, the request is also sent to this model and the "
+                     "faster reply is used"
+            )
+            if hedge_model == "Off":
+                st.session_state.llm_handler.disable_hedging()
+            else:
+                st.session_state.llm_handler.enable_hedging(
+                    hedge_model, deadline=float(os.getenv("HEDGE_DEADLINE", 2.0))
+                )
+            
+            response_cache = st.session_state.llm_handler.response_cache
+            if response_cache is not None:
+                cache_stats = response_cache.stats()
+                st.caption(
+                    f"Response cache: {cache_stats['exact_hits'] + cache_stats['semantic_hits']} hits, "
+                    f"{cache_stats['misses']} misses, {cache_stats['saved_seconds']:.1f}s saved"
+                    + ("" if st.session_state.temperature == 0 else " (used at temperature 0)")
+                )
+            
             st.header("System Instructions")
             st.session_state.system_prompt = st.text_area(
                 "System Prompt", 
@@ -335,61 +687,48 @@ def main():
                 help="Instructions that define the AI assistant's behavior",
                 placeholder="You are a helpful assistant..."
             )
+            
+            with st.expander("Diagnostics", expanded=False):
+                show_diagnostics()
         
         # Documents tab
         with docs_tab:
             st.header("Document Context")
             
-            uploaded_file = st.file_uploader(
-                "Upload a document for context", 
+            uploaded_files = st.file_uploader(
+                "Upload documents for context", 
                 type=["txt", "pdf", "docx"],
-                help="The AI will use the content of this document to inform its responses"
+                accept_multiple_files=True,
+                key="doc_uploader",
+                help="The AI will use the content of these documents to inform its responses"
             )
+            st.checkbox(
+                "Summarize long documents", key="summarize_docs",
+                help="Documents over a few pages are also summarized by the model, and the summary is "
+                     "sent with every question alongside the passages retrieved for it"
+            )
+            if uploaded_files:
+                start_ingest(uploaded_files)
             
-            if uploaded_file is not None:
-                with st.spinner("Processing document..."):
-                    try:
-                        # Process the uploaded file
-                        doc_text = st.session_state.doc_processor.process_file(uploaded_file)
-                        
-                        # Summarize if text is too long
-                        doc_text = st.session_state.doc_processor.summarize_text(doc_text, 5000)
-                        
-                        # Store in session state
-                        file_name = uploaded_file.name
-                        st.session_state.context_docs[file_name] = doc_text
-                        
-                        st.success(f"File '{file_name}' processed successfully!")
-                    except Exception as e:
-                        st.error(f"Error processing file: {str(e)}")
-                        with st.expander("Error Details"):
-                            st.code(traceback.format_exc())
-            
-            # Display uploaded documents with improved styling
-            if st.session_state.context_docs:
-                st.subheader("Active Documents")
-                for doc_name in list(st.session_state.context_docs.keys()):
-                    with st.container():
-                        col1, col2 = st.columns([5, 1])
-                        with col1:
-                            st.markdown(f"📄 **{doc_name}**")
-                            with st.expander("Preview"):
-                                st.markdown(st.session_state.context_docs[doc_name][:500] + "...")
-                        with col2:
-                            if st.button("🗑️", key=f"remove_{doc_name}"):
-                                del st.session_state.context_docs[doc_name]
-                                st.rerun()
+            # Progress and the document list refresh on their own while files are processed
+            polling = any(not job.done for job in st.session_state.ingest_jobs)
+            st.fragment(run_every=INGEST_POLL_INTERVAL if polling else None)(show_documents)(polling)
         
         # History tab
         with history_tab:
             st.header("Conversation History")
             
-            if not st.session_state.conversation_history:
+            store = conversation_store()
+            total_conversations = store.count()
+            if not total_conversations:
                 st.info("No saved conversations yet. Chat and save conversations to see them here.")
             else:
-                for conv_id, conv in sorted(st.session_state.conversation_history.items(), 
-                                           key=lambda x: x[1]["timestamp"], 
-                                           reverse=True):
+                page_count = -(-total_conversations // HISTORY_PAGE_SIZE)
+                page = min(st.session_state.history_page, page_count - 1)
+                
+                # Only the metadata for the visible page is read; messages load on "Load"
+                for conv in store.list_conversations(limit=HISTORY_PAGE_SIZE, offset=page * HISTORY_PAGE_SIZE):
+                    conv_id = conv["id"]
                     # Create a container for each conversation
                     with st.container():
                         col1, col2 = st.columns([5, 1])
@@ -407,6 +746,32 @@ def main():
                             if st.button("Load", key=f"load_{conv_id}"):
                                 load_conversation(conv_id)
                                 st.rerun()
+                
+                if page_count > 1:
+                    col1, col2, col3 = st.columns([1, 2, 1])
+                    with col1:
+                        if st.button("◀", key="history_prev", disabled=page == 0):
+                            st.session_state.history_page = page - 1
+                            st.rerun()
+                    with col2:
+                        st.caption(f"Page {page + 1} of {page_count}")
+                    with col3:
+                        if st.button("▶", key="history_next", disabled=page >= page_count - 1):
+                            st.session_state.history_page = page + 1
+                            st.rerun()
+                
+                show_export("⬇️ Export all conversations", "export_all", "conversations.jsonl.gz")
+            
+            import_file = st.file_uploader("Import conversations", type=["jsonl", "gz"],
+                                           help="A .jsonl or .jsonl.gz file from an export")
+            if import_file is not None and st.button("Import", key="import_conversations"):
+                try:
+                    conversations, message_count = import_conversations(store, import_file)
+                    # Imported conversations may replace ones held in memory
+                    st.session_state.conversation_snapshots.clear()
+                    st.success(f"Imported {conversations} conversations ({message_count} messages)")
+                except Exception as e:
+                    st.error(f"Error importing conversations: {str(e)}")
         
         # Conversation management
         st.markdown("---")
@@ -420,9 +785,14 @@ def main():
         
         with col2:
             if st.button("💾 Save Chat", use_container_width=True):
-                download_link = save_conversation()
-                st.markdown(download_link, unsafe_allow_html=True)
-                st.success("Conversation saved! You can access it in the History tab.")
+                if save_conversation():
+                    st.success("Conversation saved! You can access it in the History tab.")
+                else:
+                    st.info("No messages to save.")
+        
+        if chat_messages().saved_version is not None:
+            show_export("⬇️ Download conversation", "export_current", "conversation.jsonl.gz",
+                        (st.session_state.current_conversation_id,))
     
     # Main chat interface
     chat_container = st.container()
@@ -437,9 +807,16 @@ def main():
     # Add some space before chat messages
     st.markdown("<br>", unsafe_allow_html=True)
     
+    # A finished reply is already in the log; pick up its error, if any, before rendering
+    finish_generation()
+    job = st.session_state.generation
+    
     # Display chat messages with improved styling
-    with chat_container:
-        if not st.session_state.messages:
+    with chat_container, metrics.span("ui_render_seconds", stage="history"):
+        messages = chat_messages()
+        # The turn being generated is shown below, not from the log
+        end = job.log_start if job else len(messages)
+        if not end and not job:
             # Show welcome message when no messages exist
             st.markdown("""
             <div style="text-align: center; padding: 3rem; color: #6b7280;">
@@ -448,49 +825,48 @@ def main():
             </div>
             """, unsafe_allow_html=True)
         else:
-            for message in st.session_state.messages:
-                with st.chat_message(message["role"]):
-                    if message["role"] == "assistant":
-                        st.markdown(format_markdown_content(message["content"]))
+            # Only render the most recent messages; older ones are paged in on request
+            hidden_count = max(end - st.session_state.chat_window, 0)
+            if hidden_count:
+                if st.button(f"Load earlier messages ({hidden_count} hidden)", key="load_earlier"):
+                    st.session_state.chat_window += CHAT_WINDOW_SIZE
+                    st.rerun()
+            
+            for message in messages[hidden_count:end]:
+                with st.chat_message(message.role):
+                    if message.role == ASSISTANT:
+                        st.markdown(render_markdown(message.content))
+                        if message.stats and not message.failed:
+                            st.caption(format_response_stats(message.stats))
                     else:
-                        st.write(message["content"])
+                        st.write(message.content)
     
-    # Chat input 
+    # Chat input; one reply at a time per session
     user_input = st.chat_input(
         "Type your message here...", 
-        disabled=not st.session_state.model_initialized
+        disabled=not st.session_state.model_initialized or job is not None
     )
     
-    if user_input:
-        # Add user message to chat
-        st.session_state.messages.append({"role": "user", "content": user_input})
-        
-        # Display user message
-        with st.chat_message("user"):
-            st.write(user_input)
-        
-        # Generate response from LLM
-        if st.session_state.model_initialized:
-            with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    try:
-                        response = st.session_state.llm_handler.generate_response(
-                            user_input=user_input,
-                            system_message=st.session_state.system_prompt,
-                            temperature=st.session_state.temperature,
-                            max_tokens=st.session_state.max_tokens,
-                            context_docs=st.session_state.context_docs
-                        )
-                        st.markdown(format_markdown_content(response))
-                        
-                        # Add assistant message to chat
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                    except Exception as e:
-                        error_msg = f"Error generating response: {str(e)}"
-                        st.error(error_msg)
-                        
-                        # Add error message to chat
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+    if user_input and st.session_state.model_initialized and job is None:
+        # Generate the reply as a task on the shared event loop so this script (and the Stop button) stays responsive;
+        # the handler adds the question and the reply to the log
+        job = st.session_state.generation = GenerationJob(
+            st.session_state.llm_handler,
+            user_input=user_input,
+            system_message=st.session_state.system_prompt,
+            temperature=st.session_state.temperature,
+            max_tokens=st.session_state.max_tokens,
+            # Copies, since finished uploads are merged into these while the reply streams
+            context_docs=dict(st.session_state.context_docs),
+            doc_indexes=dict(st.session_state.doc_indexes),
+            doc_summaries=dict(st.session_state.doc_summaries),
+            top_k=int(os.getenv("RETRIEVAL_TOP_K", 4))
+        )
+    
+    # The reply so far refreshes on its own while it streams
+    if job is not None:
+        with chat_container:
+            st.fragment(run_every=GENERATION_POLL_INTERVAL)(show_generation)()
     
     # Display a footer with model info when a model is initialized
     if st.session_state.model_initialized:
@@ -501,6 +877,8 @@ def main():
             <span><strong>Max tokens:</strong> {st.session_state.max_tokens}</span>
         </div>
         """, unsafe_allow_html=True)
+    
+    write_metrics_file()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
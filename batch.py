@@ -0,0 +1,202 @@
+"""Run prompts from a JSONL file through the LLM without the Streamlit UI.
+
+Each input line is a JSON object:
+
+    {"id": "q1", "prompt": "Summarise the report",
+     "system_prompt": "You are a helpful assistant.",
+     "documents": ["report.pdf"], "model": "Llama3-8b",
+     "temperature": 0.2, "max_tokens": 512}
+
+Only "prompt" is required ("body" is accepted too); "id" falls back to
+"request_id" and then the line number. Results are appended to the output
+JSONL as they finish, so an interrupted run can be resumed with the same
+command and completed ids are skipped.
+
+Usage:
+    python batch.py prompts.jsonl -o results.jsonl --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from model import LLMHandler
+from document import DocumentProcessor
+from doc_store import DocumentStore, is_extraction_error
+from ingest import index_document
+
+# Scheduler priority for batch requests (interactive requests use 0)
+BATCH_PRIORITY = 10
+
+class LocalFile:
+    """File on disk with the interface DocumentProcessor expects from an upload."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def getvalue(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+def read_prompts(path):
+    """Yield prompt dicts from a JSONL file, filling in missing ids."""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item["id"] = str(item.get("id") or item.get("request_id") or line_number)
+            yield item
+
+def completed_ids(path):
+    """Ids already answered successfully in an existing output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; that prompt is simply rerun
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+class BatchRunner:
+    def __init__(self, output_path, concurrency=4, model_name="Llama3-8b", api_key=None,
+                 temperature=0.7, max_tokens=1024, top_k=4):
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.model_name = model_name
+        self.api_key = api_key or os.environ.get("GROQ_API_KEY")
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.doc_processor = DocumentProcessor()
+        # Documents shared by several prompts are only extracted once
+        self.doc_store = DocumentStore()
+        self._doc_indexes = {}
+        self.latencies = []
+        self.failures = 0
+
+    def _load_documents(self, paths):
+        """Extract and index documents, returning (context_docs, doc_indexes).
+
+        Raises ValueError if a document can't be extracted, so the prompt
+        is recorded as failed and retried on the next run.
+        """
+        context_docs = {}
+        doc_indexes = {}
+        for path in paths:
+            local_file = LocalFile(path)
+            text, page_offsets = self.doc_store.get_or_process(local_file, self.doc_processor)
+            if is_extraction_error(text):
+                raise ValueError(text)
+            context_docs[local_file.name] = text
+            if path not in self._doc_indexes:
+                self._doc_indexes[path] = index_document(self.doc_processor, text, page_offsets=page_offsets)
+            doc_indexes[local_file.name] = self._doc_indexes[path]
+        return context_docs, doc_indexes
+
+    async def _run_one(self, item, semaphore, output):
+        async with semaphore:
+            started_at = time.perf_counter()
+            result = {"id": item["id"]}
+            try:
+                prompt = item.get("prompt") or item.get("body")
+                if not prompt:
+                    raise ValueError("Prompt line has no 'prompt' field")
+
+                context_docs, doc_indexes = await asyncio.to_thread(
+                    self._load_documents, item.get("documents") or []
+                )
+
+                handler = LLMHandler()
+                # Let interactive sessions go ahead of batch work when rate limited
+                handler.request_priority = BATCH_PRIORITY
+                handler.initialize_model(item.get("model", self.model_name), self.api_key)
+                response = await handler.agenerate_response(
+                    user_input=prompt,
+                    system_message=item.get("system_prompt", "You are a helpful assistant."),
+                    temperature=item.get("temperature", self.temperature),
+                    max_tokens=item.get("max_tokens", self.max_tokens),
+                    context_docs=context_docs,
+                    doc_indexes=doc_indexes,
+                    top_k=self.top_k
+                )
+                # agenerate_response reports provider errors in the text
+                if response.startswith("Error generating response:"):
+                    raise RuntimeError(response)
+                result.update(status="ok", response=response)
+            except Exception as e:
+                self.failures += 1
+                result.update(status="error", error=str(e))
+
+            latency = time.perf_counter() - started_at
+            result["latency"] = round(latency, 4)
+            if result["status"] == "ok":
+                self.latencies.append(latency)
+
+            # Written as soon as it's done so a crash loses at most in-flight prompts
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    async def run(self, items):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with open(self.output_path, 'a', encoding='utf-8') as output:
+            await asyncio.gather(*(self._run_one(item, semaphore, output) for item in items))
+
+    def report(self, elapsed):
+        completed = len(self.latencies)
+        return {
+            "completed": completed,
+            "failed": self.failures,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_per_sec": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+            "latency_p50": round(percentile(self.latencies, 0.50), 3),
+            "latency_p90": round(percentile(self.latencies, 0.90), 3),
+            "latency_p99": round(percentile(self.latencies, 0.99), 3),
+        }
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Run JSONL prompts through the LLM.")
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Requests in flight at once")
+    parser.add_argument("--model", default=os.getenv("DEFAULT_MODEL", "Llama3-8b"), help="Default model name")
+    parser.add_argument("--temperature", type=float, default=float(os.getenv("DEFAULT_TEMPERATURE", 0.7)))
+    parser.add_argument("--max-tokens", type=int, default=int(os.getenv("DEFAULT_MAX_TOKENS", 1024)))
+    parser.add_argument("--top-k", type=int, default=4, help="Document chunks sent per document")
+    args = parser.parse_args(argv)
+
+    done = completed_ids(args.output)
+    items = [item for item in read_prompts(args.input) if item["id"] not in done]
+    if done:
+        print(f"Skipping {len(done)} prompts already completed in {args.output}", file=sys.stderr)
+
+    runner = BatchRunner(args.output, concurrency=args.concurrency, model_name=args.model,
+                         temperature=args.temperature, max_tokens=args.max_tokens, top_k=args.top_k)
+    started_at = time.perf_counter()
+    asyncio.run(runner.run(items))
+    report = runner.report(time.perf_counter() - started_at)
+    print(json.dumps(report, indent=2))
+    return 0 if not runner.failures else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Local stand-in for the Groq (OpenAI-compatible) chat completions API.
+
+Serves POST .../chat/completions with a canned reply, both as a single JSON
+response and as a server-sent event stream, with configurable latency,
+token rate and error injection. Point the app or benchmarks at it with:
+
+    GROQ_API_BASE=http://127.0.0.1:<port>
+
+Run standalone:
+    python -m benchmarks.fake_server --port 8999 --latency 0.2 --tokens-per-sec 200
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeServerConfig:
+    def __init__(self, latency=0.05, tokens_per_sec=500.0, response_tokens=64,
+                 error_rate=0.0, retry_after=0.1, seed=0):
+        # Seconds before the first byte of a response
+        self.latency = latency
+        # Rate at which streamed tokens are sent (0 means as fast as possible)
+        self.tokens_per_sec = tokens_per_sec
+        # Number of tokens ("word " pieces) in every reply
+        self.response_tokens = response_tokens
+        # Fraction of requests answered with 429 Too Many Requests
+        self.error_rate = error_rate
+        # Retry-After sent with injected 429s
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        with self.server.lock:
+            self.server.requests += 1
+            inject_error = config.random.random() < config.error_rate
+        if inject_error:
+            with self.server.lock:
+                self.server.errors += 1
+            self._send_json(429, {"error": {"message": "Rate limit reached (injected)", "type": "requests"}},
+                            {"retry-after": str(config.retry_after)})
+            return
+
+        time.sleep(config.latency)
+
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 + 1
+                            for message in request.get("messages", []))
+        completion_tokens = min(config.response_tokens, request.get("max_tokens") or config.response_tokens)
+        model = request.get("model", "fake-model")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        if request.get("stream"):
+            self._stream(completion_id, created, model, completion_tokens, usage)
+            return
+
+        if config.tokens_per_sec:
+            time.sleep(completion_tokens / config.tokens_per_sec)
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "word " * completion_tokens},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, created, model, completion_tokens, usage):
+        config = self.server.config
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(delta, finish_reason=None, extra=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if extra:
+                chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            event({"role": "assistant", "content": ""})
+            delay = 1.0 / config.tokens_per_sec if config.tokens_per_sec else 0
+            for _ in range(completion_tokens):
+                event({"content": "word "})
+                if delay:
+                    time.sleep(delay)
+            event({}, "stop", {"x_groq": {"usage": usage}})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            with self.server.lock:
+                self.server.cancelled += 1
+        self.close_connection = True
+
+class FakeChatServer:
+    """Fake chat completions server running on a background thread."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeServerConfig()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.config = self.config
+        self._server.lock = threading.Lock()
+        self._server.requests = 0
+        self._server.errors = 0
+        self._server.cancelled = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self):
+        with self._server.lock:
+            return {"requests": self._server.requests, "errors": self._server.errors,
+                    "cancelled": self._server.cancelled}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Groq chat completions server.")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first byte")
+    parser.add_argument("--tokens-per-sec", type=float, default=500.0)
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    config = FakeServerConfig(args.latency, args.tokens_per_sec, args.response_tokens, args.error_rate)
+    server = FakeChatServer(config, port=args.port)
+    print(f"Fake chat server listening on {server.base_url}")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Cold-start import report for the app.
+
+Imports app.py in a fresh interpreter with ``-X importtime``, prints the
+slowest imports, and fails if a module that should load lazily (LangChain,
+the Groq client, PyMuPDF, python-docx) is imported up front or the total
+exceeds a budget.
+
+Usage (from the repository root):
+    python -m benchmarks.import_report
+    python -m benchmarks.import_report --budget 1.5 --top 15 -o imports.json
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules that must not be imported just by loading the app
+LAZY_MODULES = ("langchain", "langchain_groq", "langchain_core", "fitz", "pymupdf", "docx",
+                "sentence_transformers")
+
+def measure(module="app"):
+    """Import ``module`` in a subprocess.
+
+    Returns ``(total_seconds, imports, direct)``: cumulative seconds for
+    every module loaded, and for the modules ``module`` imports directly.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    imports = {}
+    direct = {}
+    children = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented two spaces per level and listed before their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        seconds = int(cumulative_us) / 1e6
+        imports[name] = seconds
+        if depth == 1:
+            children[name] = seconds
+        elif depth == 0:
+            if name == module:
+                direct = children
+            children = {}
+    return imports.get(module, 0.0), imports, direct
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report what importing the app costs.")
+    parser.add_argument("--module", default="app", help="Module to import")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list")
+    parser.add_argument("--budget", type=float, default=None, help="Fail if the import takes longer (seconds)")
+    parser.add_argument("-o", "--output", default=None, help="Also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    total, imports, direct = measure(args.module)
+    eager = sorted({name.split(".")[0] for name in imports if name.split(".")[0] in LAZY_MODULES})
+    slowest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f"import {args.module}: {total:.3f}s")
+    for name, seconds in slowest:
+        print(f"  {name:40s} {seconds * 1000:9.1f}ms")
+
+    failures = []
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if args.budget is not None and total > args.budget:
+        failures.append(f"took {total:.3f}s, budget is {args.budget:.3f}s")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({"module": args.module, "total": total, "slowest": dict(slowest),
+                       "eager_lazy_modules": eager}, file, indent=2)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
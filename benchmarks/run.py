@@ -0,0 +1,227 @@
+"""Micro-benchmarks for the chat and document hot paths.
+
+Runs against a local fake chat completions server (benchmarks/fake_server.py),
+so no API key or network access is needed, and writes machine-readable
+results that can be diffed between runs.
+
+Usage (from the repository root):
+    python -m benchmarks.run -o bench.json
+    python -m benchmarks.run --quick --latency 0.1 --tokens-per-sec 200
+"""
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Keep the shared rate limiter out of the way; set before model is imported
+os.environ.setdefault("RATE_LIMIT_RPM", "1000000")
+os.environ.setdefault("RATE_LIMIT_TPM", "1000000000")
+
+from benchmarks.fake_server import FakeChatServer, FakeServerConfig
+
+def summarize(samples):
+    """Summary statistics (in seconds) for a list of timings."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"n": 0}
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+def timed(fn, repeat):
+    """Time fn() repeat times. A call returning False failed: it is counted, not timed."""
+    samples = []
+    errors = 0
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        if fn() is False:
+            errors += 1
+            continue
+        samples.append(time.perf_counter() - started_at)
+    summary = summarize(samples)
+    summary["errors"] = errors
+    return summary
+
+class UploadedBytes(io.BytesIO):
+    """In-memory file with the interface of a Streamlit upload."""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+def sample_text(paragraphs):
+    return "".join(
+        f"Paragraph {i}. The quick brown fox jumps over the lazy dog while the report "
+        f"discusses quarterly figures, risks and forecasts in section {i % 17}.\n\n"
+        for i in range(paragraphs)
+    )
+
+def make_pdf(pages):
+    import fitz
+    doc = fitz.open()
+    text = sample_text(12)
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def make_docx(paragraphs):
+    import docx
+    doc = docx.Document()
+    for paragraph in sample_text(paragraphs).split("\n\n")[:-1]:
+        doc.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def bench_llm(results, repeat, history_turns):
+    from model import LLMHandler
+    from message_log import Message
+
+    handler = LLMHandler()
+    handler.initialize_model("Llama3-8b", "benchmark-key")
+
+    def generate():
+        # Provider errors come back as the reply text
+        response = handler.generate_response("Summarise the quarterly figures.", temperature=0.7, max_tokens=256)
+        return not response.startswith("Error generating response:")
+
+    results["llm.generate_response"] = timed(generate, repeat)
+
+    ttfts = []
+    def stream():
+        for _ in handler.stream_response("Summarise the quarterly figures.", temperature=0.7, max_tokens=256):
+            pass
+        # No stats means the request failed
+        if handler.last_response_stats is None:
+            return False
+        ttfts.append(handler.last_response_stats["time_to_first_token"])
+
+    results["llm.stream_response"] = timed(stream, repeat)
+    results["llm.stream_response.time_to_first_token"] = summarize(ttfts)
+
+    # Long history: measures prompt assembly and token budgeting per turn
+    handler.load_messages(
+        [Message("user" if i % 2 == 0 else "assistant", sample_text(3)) for i in range(history_turns)]
+    )
+    results[f"llm.generate_response.history_{history_turns}"] = timed(generate, repeat)
+
+def bench_documents(results, sizes, repeat):
+    from document import DocumentProcessor
+
+    processor = DocumentProcessor()
+    for size in sizes:
+        fixtures = {
+            f"pdf_{size}_pages": UploadedBytes("bench.pdf", make_pdf(size)),
+            f"docx_{size * 12}_paragraphs": UploadedBytes("bench.docx", make_docx(size * 12)),
+            f"txt_{size * 12}_paragraphs": UploadedBytes("bench.txt", sample_text(size * 12).encode('utf-8')),
+        }
+        for name, upload in fixtures.items():
+            results[f"document.process_file.{name}"] = timed(lambda: processor.process_file(upload), repeat)
+
+        text = sample_text(size * 12)
+        results[f"document.chunk_text.{len(text)}_chars"] = timed(lambda: processor.chunk_text(text), repeat)
+        results[f"document.iter_text_chunks.{len(text)}_chars"] = timed(
+            lambda: list(processor.iter_text_chunks(text)), repeat
+        )
+        results[f"document.build_index.{len(text)}_chars"] = timed(lambda: processor.build_index(text), repeat)
+
+def bench_conversations(results, lengths, repeat):
+    from model import LLMHandler
+    from conversation_store import ConversationStore
+    from message_log import Message
+
+    handler = LLMHandler()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = ConversationStore(os.path.join(tmp_dir, "bench.db"))
+        for length in lengths:
+            conversation_id = f"bench-{length}"
+            messages = [Message("user" if i % 2 == 0 else "assistant", sample_text(2)) for i in range(length)]
+            store.save({"id": conversation_id, "title": "bench", "timestamp": "2024-01-01 00:00:00",
+                        "model": "Llama3-8b", "temperature": 0.7, "max_tokens": 1024,
+                        "system_prompt": "You are a helpful assistant."}, messages)
+
+            # What app.load_conversation does: read messages, rebuild the handler's history
+            def load():
+                handler.load_messages(store.load_messages(conversation_id))
+
+            results[f"conversation.load_conversation.{length}_messages"] = timed(load, repeat)
+
+            # Switching back to a conversation still held in memory
+            handler.load_messages(store.load_messages(conversation_id))
+            snapshot = handler.snapshot()
+
+            def switch():
+                handler.reset_memory()
+                handler.restore(snapshot)
+
+            results[f"conversation.switch_conversation.{length}_messages"] = timed(switch, repeat)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the micro-benchmark suite.")
+    parser.add_argument("-o", "--output", default="bench_output.json", help="Where to write JSON results")
+    parser.add_argument("--quick", action="store_true", help="Fewer repetitions and smaller fixtures")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake server latency in seconds")
+    parser.add_argument("--tokens-per-sec", type=float, default=2000.0, help="Fake server token rate")
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake 429 responses")
+    args = parser.parse_args(argv)
+
+    repeat = 3 if args.quick else 10
+    sizes = (5, 25) if args.quick else (10, 100, 500)
+    lengths = (50, 500) if args.quick else (100, 1000, 5000)
+
+    config = FakeServerConfig(args.latency, args.tokens_per_sec, args.response_tokens, args.error_rate)
+    results = {}
+    with FakeChatServer(config) as server:
+        os.environ["GROQ_API_BASE"] = server.base_url
+        bench_llm(results, repeat, history_turns=lengths[-1])
+        server_stats = server.stats()
+    bench_documents(results, sizes, repeat)
+    bench_conversations(results, lengths, repeat)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "fake_server": {"latency": args.latency, "tokens_per_sec": args.tokens_per_sec,
+                            "response_tokens": args.response_tokens, "error_rate": args.error_rate,
+                            **server_stats},
+        },
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    for name, summary in results.items():
+        errors = f"  errors={summary['errors']}" if summary.get("errors") else ""
+        if not summary["n"]:
+            print(f"{name:60s} no successful runs{errors}")
+            continue
+        print(f"{name:60s} p50={summary['p50'] * 1000:9.2f}ms  p95={summary['p95'] * 1000:9.2f}ms{errors}")
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import asyncio
+import hashlib
+import threading
+
+# Chat clients shared by every session in the process, keyed by
+# (model_id, api key hash, base url). Each client owns its HTTP connection
+# pool, so sessions using the same model and key reuse warm connections.
+_clients = {}
+_clients_lock = threading.Lock()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _key_hash(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+def get_chat_client(model_id, api_key):
+    """Return the shared chat client for a model and API key, creating it once.
+
+    Clients are shared across sessions, so per-request settings such as
+    temperature and max_tokens must be passed to each call rather than set
+    on the client.
+    """
+    base_url = os.environ.get("GROQ_API_BASE")
+    key = (model_id, _key_hash(api_key), base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Imported here: langchain_groq is slow to load and only needed once a model is chosen
+            from langchain_groq import ChatGroq
+            client = ChatGroq(
+                model_name=model_id,
+                groq_api_key=api_key,
+                temperature=float(os.environ.get("DEFAULT_TEMPERATURE", 0.7)),
+                max_tokens=int(os.environ.get("DEFAULT_MAX_TOKENS", 1024)),
+                # 429s are retried by the rate limit scheduler, not the SDK
+                max_retries=0
+            )
+            _clients[key] = client
+        return client
+
+def get_event_loop():
+    """Return the process-wide event loop used for async generation.
+
+    The loop runs on one daemon thread. Async HTTP clients are bound to the
+    loop they first ran on, so sharing one loop lets every session reuse the
+    same async connection pool, and waiting requests cost a coroutine rather
+    than a blocked thread each.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True)
+            thread.start()
+        return _loop
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop and return a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
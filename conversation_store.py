@@ -0,0 +1,175 @@
+import copy
+import json
+import sqlite3
+import threading
+from message_log import Message
+
+_META_COLUMNS = ("id", "title", "timestamp", "model", "temperature",
+                 "max_tokens", "system_prompt", "message_count")
+
+def _message_rows(conversation_id, messages, start):
+    return [
+        (conversation_id, seq, message.role, message.content,
+         json.dumps(message.stats) if message.stats else None)
+        for seq, message in enumerate(messages, start)
+    ]
+
+class ConversationStore:
+    """SQLite-backed store for saved conversations.
+
+    Conversation metadata and message bodies live in separate tables, so
+    listing conversations (newest first, a page at a time, via an index on
+    timestamp) never reads any messages. Messages are only loaded for the
+    conversation being opened.
+
+    Every conversation belongs to an owner, and a store only sees and
+    writes its own owner's conversations. for_owner() returns a view of
+    the same database for another owner, so one connection can serve
+    every session while keeping their histories apart.
+    """
+
+    def __init__(self, path="conversations.db", owner=""):
+        self.path = path
+        self.owner = owner
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    timestamp TEXT,
+                    model TEXT,
+                    temperature REAL,
+                    max_tokens INTEGER,
+                    system_prompt TEXT,
+                    message_count INTEGER,
+                    owner TEXT NOT NULL DEFAULT ''
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    conversation_id TEXT,
+                    seq INTEGER,
+                    role TEXT,
+                    content TEXT,
+                    stats TEXT,
+                    PRIMARY KEY (conversation_id, seq)
+                );
+            """)
+            # Databases from before owners were recorded: their conversations go to the default owner
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(conversations)")]
+            if "owner" not in columns:
+                self._db.execute("ALTER TABLE conversations ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+            self._db.execute("DROP INDEX IF EXISTS conversations_timestamp")
+            self._db.execute("CREATE INDEX IF NOT EXISTS conversations_owner_timestamp "
+                             "ON conversations (owner, timestamp)")
+            self._db.commit()
+
+    def for_owner(self, owner):
+        """A view of this store holding only owner's conversations (same connection)."""
+        view = copy.copy(self)
+        view.owner = owner
+        return view
+
+    def is_writable(self, conversation_id):
+        """True unless the id is taken by another owner's conversation."""
+        with self._lock:
+            row = self._db.execute("SELECT owner FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return row is None or row[0] == self.owner
+
+    def save(self, conversation, messages, start=0):
+        """Insert or replace a conversation's metadata and messages.
+
+        Messages before ``start`` are assumed to be stored already and are
+        left alone, so saving a conversation that only grew writes just
+        its new messages. Raises ValueError if the id belongs to another
+        owner's conversation.
+        """
+        rows = _message_rows(conversation["id"], messages[start:], start)
+        columns = _META_COLUMNS + ("owner",)
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                f"INSERT INTO conversations ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in columns)} "
+                "WHERE owner = excluded.owner",
+                tuple(conversation.get(column) for column in _META_COLUMNS[:-1]) + (len(messages), self.owner)
+            )
+            if not cursor.rowcount:
+                raise ValueError(f"Conversation {conversation['id']} belongs to another user")
+            self._db.execute("DELETE FROM messages WHERE conversation_id = ? AND seq >= ?",
+                             (conversation["id"], start))
+            self._db.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?)", rows)
+
+    def append_messages(self, conversation_id, messages, start):
+        """Store messages at positions start, start + 1, ... of a saved conversation."""
+        rows = _message_rows(conversation_id, messages, start)
+        with self._lock, self._db:
+            cursor = self._db.execute("UPDATE conversations SET message_count = ? WHERE id = ? AND owner = ?",
+                                      (start + len(messages), conversation_id, self.owner))
+            if not cursor.rowcount:
+                raise ValueError(f"Conversation {conversation_id} not found")
+            self._db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)", rows)
+
+    def count(self):
+        """Number of saved conversations."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM conversations WHERE owner = ?",
+                                    (self.owner,)).fetchone()[0]
+
+    def list_conversations(self, limit=10, offset=0):
+        """Return one page of conversation metadata, newest first."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_META_COLUMNS)} FROM conversations WHERE owner = ? "
+                "ORDER BY timestamp DESC LIMIT ? OFFSET ?", (self.owner, limit, offset)
+            ).fetchall()
+        return [dict(zip(_META_COLUMNS, row)) for row in rows]
+
+    def get(self, conversation_id):
+        """Return a conversation's metadata, or None."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_META_COLUMNS)} FROM conversations WHERE id = ? AND owner = ?",
+                (conversation_id, self.owner)
+            ).fetchone()
+        return dict(zip(_META_COLUMNS, row)) if row else None
+
+    def load_messages(self, conversation_id):
+        """Return a conversation's messages as Message records."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content, stats FROM messages WHERE conversation_id = ? "
+                "AND EXISTS (SELECT 1 FROM conversations WHERE id = ? AND owner = ?) ORDER BY seq",
+                (conversation_id, conversation_id, self.owner)
+            ).fetchall()
+        return [Message(role, content, json.loads(stats) if stats else None) for role, content, stats in rows]
+
+    def iter_conversations(self, batch_size=100):
+        """Yield the metadata of every conversation, reading batch_size rows at a time."""
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT {', '.join(_META_COLUMNS)} FROM conversations WHERE owner = ? AND id > ? "
+                    "ORDER BY id LIMIT ?", (self.owner, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(_META_COLUMNS, row))
+            last_id = rows[-1][0]
+
+    def iter_messages(self, conversation_id, batch_size=500):
+        """Yield a conversation's messages in order, reading batch_size rows at a time."""
+        last_seq = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT seq, role, content, stats FROM messages WHERE conversation_id = ? AND seq > ? "
+                    "AND EXISTS (SELECT 1 FROM conversations WHERE id = ? AND owner = ?) ORDER BY seq LIMIT ?",
+                    (conversation_id, last_seq, conversation_id, self.owner, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for _, role, content, stats in rows:
+                yield Message(role, content, json.loads(stats) if stats else None)
+            last_seq = rows[-1][0]
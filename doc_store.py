@@ -0,0 +1,142 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+def is_extraction_error(text):
+    """True for the messages DocumentProcessor returns instead of text when extraction fails."""
+    return text == "Unsupported file format" or text.startswith("Error extracting")
+
+class DocumentStore:
+    """Content-addressed cache of extracted document text.
+
+    Entries are keyed by a SHA-256 hash of the uploaded file's bytes, so the
+    same file uploaded again (or seen again on a Streamlit rerun) is served
+    from memory instead of being parsed a second time. The in-memory tier is
+    bounded by total text size and evicts least recently used entries. When
+    ``persist_dir`` is set, every entry is also written to disk and reloaded
+    from there on a memory miss.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, persist_dir=None):
+        self.max_bytes = max_bytes
+        self.persist_dir = persist_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_content(data):
+        """Return the content hash used as the cache key."""
+        return hashlib.sha256(data).hexdigest()
+
+    def get(self, key):
+        """Return the cached text for a content hash, or None."""
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+
+        text = self._read_from_disk(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, text)
+        return text
+
+    def put(self, key, text):
+        """Cache extracted text under its content hash."""
+        with self._lock:
+            self._insert(key, text)
+        self._write_to_disk(key, text)
+
+    def get_or_process(self, uploaded_file, processor):
+        """Return an upload's (text, page_offsets), extracting it only on a cache miss.
+
+        page_offsets is None for formats without pages (see
+        DocumentProcessor.process_file_pages); they're cached as a small
+        entry of their own next to the text.
+        """
+        key = self.hash_content(uploaded_file.getvalue())
+        text = self.get(key)
+        if text is not None:
+            pages = self.get(f"{key}-pages")
+            return text, [int(offset) for offset in pages.split()] if pages else None
+        text, page_offsets = processor.process_file_pages(uploaded_file)
+        # Extraction failures come back as messages; don't cache those
+        if not is_extraction_error(text):
+            self.put(key, text)
+            if page_offsets:
+                self.put(f"{key}-pages", " ".join(map(str, page_offsets)))
+        return text, page_offsets
+
+    def clear(self):
+        """Drop all in-memory entries. Files on disk are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """Return cache occupancy and hit/miss counts."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _insert(self, key, text):
+        """Add an entry and evict old ones. Caller must hold the lock."""
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+
+        # Entries larger than the whole budget are only kept on disk
+        if len(text) > self.max_bytes:
+            return
+
+        self._entries[key] = text
+        self._size += len(text)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.persist_dir, f"{key}.txt")
+
+    def _read_from_disk(self, key):
+        if not self.persist_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cached document {key}: {str(e)}")
+            return None
+
+    def _write_to_disk(self, key, text):
+        if not self.persist_dir:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            # Write to a temp name first so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error persisting cached document {key}: {str(e)}")
@@ -1,29 +1,115 @@
+import io
 import os
+import codecs
+import hashlib
 import tempfile
-import fitz  # PyMuPDF
-import docx
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import functools
+import threading
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from retrieval import ChunkIndex
+from embeddings import EmbeddingIndex
+from metrics import get_metrics
+
+# PDFs with at least this many pages are split across worker processes
+PDF_PARALLEL_MIN_PAGES = 32
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool():
+    """Process pool shared by all PDF extractions, created on first use.
+
+    Workers are spawned rather than forked: the app process runs several
+    threads (ingestion, the event loop, the metrics server), and forking
+    a multi-threaded process can copy locks held by other threads.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+# PyMuPDF, python-docx and the LangChain splitter are slow to import, so they
+# are loaded the first time a document of that kind is processed
+
+def _fitz():
+    import fitz  # PyMuPDF
+    return fitz
+
+def _docx():
+    import docx
+    return docx
+
+@functools.lru_cache(maxsize=None)
+def get_text_splitter(chunk_size, chunk_overlap):
+    """Text splitter shared by every processor with these settings."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+def _extract_pdf_page_range(data, start, stop):
+    """Extract the text of pages [start, stop) from PDF bytes (runs in a worker process)."""
+    doc = _fitz().open(stream=data, filetype="pdf")
+    try:
+        return [doc.load_page(page_num).get_text() for page_num in range(start, stop)]
+    finally:
+        doc.close()
+
+# A chunk of a document with its character offsets in the extracted text and
+# the (zero-based) page it starts on; page is None for formats without pages
+DocumentChunk = namedtuple("DocumentChunk", ["text", "start", "end", "page"])
+
+# How much is read from a TXT upload at a time when streaming
+TXT_BLOCK_SIZE = 64 * 1024
+
+# How many DOCX paragraphs are joined into one segment when streaming
+DOCX_PARAGRAPH_BATCH = 50
+
+_CHUNK_SEPARATORS = ("\n\n", "\n", " ")
 
 class DocumentProcessor:
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
+    
+    @property
+    def text_splitter(self):
+        return get_text_splitter(self.chunk_size, self.chunk_overlap)
     
     def process_file(self, uploaded_file):
         """Process uploaded file and extract text content."""
+        return self.process_file_pages(uploaded_file)[0]
+    
+    def process_file_pages(self, uploaded_file):
+        """Extract an upload's text along with the offsets its pages start at.
+
+        Returns ``(text, page_offsets)``; page_offsets is None for formats
+        without pages (see extract_pdf_pages).
+        """
         file_name = uploaded_file.name
         file_extension = os.path.splitext(file_name)[1].lower()
         
+        # Keep the label set small: anything unsupported is timed as "other"
+        file_format = file_extension.lstrip('.') if file_extension in ('.pdf', '.docx', '.txt') else "other"
+        with get_metrics().span("document_process_seconds", format=file_format):
+            return self._extract_file_text(uploaded_file, file_extension)
+    
+    def _extract_file_text(self, uploaded_file, file_extension):
+        # PDFs are read straight from the upload's bytes, no temp file needed
+        if file_extension == '.pdf':
+            try:
+                return self.extract_pdf_pages(uploaded_file.getvalue())
+            except Exception as e:
+                return f"Error extracting PDF text: {str(e)}", None
+        
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
             tmp_file.write(uploaded_file.getvalue())
             tmp_path = tmp_file.name
         
         try:
-            if file_extension == '.pdf':
-                text = self._extract_pdf_text(tmp_path)
-            elif file_extension == '.docx':
+            if file_extension == '.docx':
                 text = self._extract_docx_text(tmp_path)
             elif file_extension == '.txt':
                 text = self._extract_txt_text(tmp_path)
@@ -32,27 +118,47 @@ class DocumentProcessor:
         finally:
             os.unlink(tmp_path)  # Clean up the temp file
         
-        return text
+        return text, None
     
-    def _extract_pdf_text(self, file_path):
-        """Extract text from PDF file."""
-        text = ""
+    def extract_pdf_pages(self, data, max_workers=None):
+        """Extract text from PDF bytes, splitting large documents across processes.
+
+        Returns ``(text, page_offsets)`` where ``page_offsets[i]`` is the
+        character offset in ``text`` at which page ``i`` starts; pass them
+        to iter_text_chunks so chunks know their page.
+        """
+        doc = _fitz().open(stream=data, filetype="pdf")
         try:
-            doc = fitz.open(file_path)
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                text += page.get_text()
+            page_count = len(doc)
+            workers = max_workers or os.cpu_count() or 1
+            if page_count < PDF_PARALLEL_MIN_PAGES or workers == 1:
+                pages = [page.get_text() for page in doc]
+        finally:
             doc.close()
-        except Exception as e:
-            text = f"Error extracting PDF text: {str(e)}"
         
-        return text
+        if page_count >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+            # One contiguous page range per worker; map keeps results in page order
+            step = -(-page_count // workers)
+            starts = list(range(0, page_count, step))
+            stops = [min(start + step, page_count) for start in starts]
+            pages = []
+            for page_texts in _get_pdf_pool().map(_extract_pdf_page_range,
+                                                  [data] * len(starts), starts, stops):
+                pages.extend(page_texts)
+        
+        page_offsets = []
+        offset = 0
+        for page_text in pages:
+            page_offsets.append(offset)
+            offset += len(page_text)
+        
+        return "".join(pages), page_offsets
     
     def _extract_docx_text(self, file_path):
         """Extract text from DOCX file."""
         text = ""
         try:
-            doc = docx.Document(file_path)
+            doc = _docx().Document(file_path)
             for para in doc.paragraphs:
                 text += para.text + "\n"
         except Exception as e:
@@ -70,16 +176,191 @@ class DocumentProcessor:
         
         return text
     
+    def iter_chunks(self, uploaded_file):
+        """Lazily extract and chunk an uploaded file.
+
+        Text is pulled one PDF page, DOCX paragraph batch or TXT block at a
+        time and chunks are yielded as soon as they're complete, so memory
+        stays bounded by the chunk size plus overlap (plus one segment)
+        rather than the size of the document.
+        """
+        file_extension = os.path.splitext(uploaded_file.name)[1].lower()
+        if file_extension == '.pdf':
+            segments = self._iter_pdf_segments(uploaded_file)
+        elif file_extension == '.docx':
+            segments = self._iter_docx_segments(uploaded_file)
+        elif file_extension == '.txt':
+            segments = self._iter_txt_segments(uploaded_file)
+        else:
+            raise ValueError(f"Unsupported file format: {file_extension}")
+        
+        return self._chunk_segments(segments)
+    
+    def iter_text_chunks(self, text, page_offsets=None):
+        """Lazily chunk text that has already been extracted, like iter_chunks.
+
+        Unlike chunk_text, no list of splits is built next to the text, so
+        indexing a long document needs little memory beyond the chunks kept.
+        With the page_offsets from extract_pdf_pages, each chunk gets the
+        page it starts on.
+        """
+        return self._chunk_segments(self._iter_text_segments(text, page_offsets))
+    
+    def _iter_text_segments(self, text, page_offsets):
+        """Yield (text, page) blocks of extracted text; a page's first block carries its number."""
+        starts = page_offsets or [0]
+        stops = starts[1:] + [len(text)]
+        for page, (start, stop) in enumerate(zip(starts, stops)):
+            label = page if page_offsets else None
+            for block_start in range(start, stop, TXT_BLOCK_SIZE):
+                yield text[block_start:min(block_start + TXT_BLOCK_SIZE, stop)], label
+                label = None
+    
+    def _split_chunks(self, chunks):
+        """Chunk strings and their pages (None if unknown) from text or an iterable of chunks."""
+        if isinstance(chunks, str):
+            chunks = self.iter_text_chunks(chunks)
+        texts = []
+        pages = []
+        for chunk in chunks:
+            if isinstance(chunk, DocumentChunk):
+                texts.append(chunk.text)
+                pages.append(chunk.page)
+            else:
+                texts.append(chunk)
+                pages.append(None)
+        return texts, pages if any(page is not None for page in pages) else None
+    
+    def _iter_pdf_segments(self, uploaded_file):
+        """Yield (text, page) for each PDF page."""
+        doc = _fitz().open(stream=uploaded_file.getvalue(), filetype="pdf")
+        try:
+            for page_num in range(len(doc)):
+                yield doc.load_page(page_num).get_text(), page_num
+        finally:
+            doc.close()
+    
+    def _iter_docx_segments(self, uploaded_file):
+        """Yield (text, None) for each batch of DOCX paragraphs."""
+        doc = _docx().Document(io.BytesIO(uploaded_file.getvalue()))
+        batch = []
+        for para in doc.paragraphs:
+            batch.append(para.text + "\n")
+            if len(batch) >= DOCX_PARAGRAPH_BATCH:
+                yield "".join(batch), None
+                batch = []
+        if batch:
+            yield "".join(batch), None
+    
+    def _iter_txt_segments(self, uploaded_file):
+        """Yield (text, None) for each block of a UTF-8 TXT upload."""
+        stream = uploaded_file if hasattr(uploaded_file, 'read') else io.BytesIO(uploaded_file.getvalue())
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            block = stream.read(TXT_BLOCK_SIZE)
+            text = decoder.decode(block, final=not block)
+            if text:
+                yield text, None
+            if not block:
+                break
+    
+    def _chunk_segments(self, segments):
+        """Split a stream of (text, page) segments into overlapping DocumentChunks."""
+        buffer = ""
+        buffer_start = 0
+        # (offset, page) for every page that starts inside or before the buffer
+        page_starts = []
+        
+        def page_at(offset):
+            page = None
+            for start, page_num in page_starts:
+                if start > offset:
+                    break
+                page = page_num
+            return page
+        
+        def next_cut(final):
+            """Where to end the next chunk, or None if more text is needed."""
+            if len(buffer) <= self.chunk_size:
+                return len(buffer) if final and buffer.strip() else None
+            # Prefer breaking on a paragraph, line or word boundary past the overlap
+            for separator in _CHUNK_SEPARATORS:
+                cut = buffer.rfind(separator, self.chunk_overlap + 1, self.chunk_size)
+                if cut != -1:
+                    return cut + len(separator)
+            return self.chunk_size
+        
+        def emit(final):
+            nonlocal buffer, buffer_start, page_starts
+            cut = next_cut(final)
+            while cut is not None:
+                chunk = buffer[:cut]
+                if chunk.strip():
+                    yield DocumentChunk(chunk, buffer_start, buffer_start + cut, page_at(buffer_start))
+                if cut >= len(buffer):
+                    buffer_start += len(buffer)
+                    buffer = ""
+                    break
+                keep_from = max(cut - self.chunk_overlap, 1)
+                buffer = buffer[keep_from:]
+                buffer_start += keep_from
+                # Drop page markers that are now entirely behind the buffer
+                while len(page_starts) > 1 and page_starts[1][0] <= buffer_start:
+                    page_starts.pop(0)
+                cut = next_cut(final)
+        
+        for text, page in segments:
+            if page is not None:
+                page_starts.append((buffer_start + len(buffer), page))
+            buffer += text
+            yield from emit(final=False)
+        yield from emit(final=True)
+    
     def chunk_text(self, text):
         """Split text into manageable chunks."""
         chunks = self.text_splitter.split_text(text)
         return chunks
     
-    def summarize_text(self, text, max_length=1000):
-        """Create a summary of text if it's too long."""
+    def build_index(self, chunks):
+        """Build a searchable index over chunks.
+
+        ``chunks`` is a text, which is chunked lazily, or an iterable of
+        chunks such as iter_chunks returns. DocumentChunks keep their page
+        in the index.
+        """
+        texts, pages = self._split_chunks(chunks)
+        return ChunkIndex(texts, pages=pages)
+    
+    def build_embedding_index(self, chunks, embedder, cache_dir=None):
+        """Build a dense embedding index over chunks (a text or an iterable, as for build_index).
+
+        With cache_dir set, the index is saved under a hash of the chunks and
+        reopened memory-mapped the next time the same chunks are indexed.
+        """
+        chunks, pages = self._split_chunks(chunks)
+        if not cache_dir:
+            return EmbeddingIndex(embedder, chunks, pages=pages)
+        
+        digest = hashlib.sha256()
+        for chunk, page in zip(chunks, pages or [None] * len(chunks)):
+            digest.update(chunk.encode('utf-8'))
+            digest.update(f"\0{page}\0".encode('utf-8') if page is not None else b"\0")
+        path = os.path.join(cache_dir, embedder.name, digest.hexdigest())
+        return EmbeddingIndex.load_or_build(path, chunks, embedder, pages=pages)
+    
+    def summarize_text(self, text, max_length=1000, summarizer=None):
+        """Create a summary of text if it's too long.
+
+        With a summarize.Summarizer the summary is a map-reduce digest of the
+        whole text (errors are raised); without one the text is truncated.
+        """
         if len(text) <= max_length:
             return text
         
-        # Simple summarization - return first part of text
-        # In a real implementation, you could use an LLM to summarize
+        if summarizer is not None:
+            return summarizer.summarize(text)
+        
+        # Without an LLM, fall back to the first part of the text
         return text[:max_length] + "... [text truncated]"
\ No newline at end of file
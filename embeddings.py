@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import numpy as np
+from retrieval import tokenize, select_chunks
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder that needs no model download.
+
+    Each token is hashed into one of ``dim`` buckets with a +/-1 sign and the
+    resulting vector is L2-normalised. Good enough for offline builds and
+    tests; use SentenceTransformerEmbedder for real semantic search.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _bucket(self, token):
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts):
+        """Embed a batch of texts into a (len(texts), dim) float32 matrix."""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                bucket, sign = self._bucket(token)
+                vectors[row, bucket] += sign
+        return _normalize(vectors)
+
+class SentenceTransformerEmbedder:
+    """Embedder backed by a sentence-transformers model, loaded on first use."""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self.name = f"st-{model_name}"
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        """Embed a batch of texts into a (len(texts), dim) float32 matrix."""
+        vectors = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class EmbeddingIndex:
+    """Dense vector index over document chunks.
+
+    Embeddings live in one contiguous float32 matrix with one row per chunk,
+    so a query is a single matrix-vector product. Saved indexes are reopened
+    memory-mapped, which makes loading cheap and avoids re-embedding after a
+    restart. ``search`` matches ChunkIndex so either can be passed to
+    LLMHandler as a document index.
+    """
+
+    EMBEDDINGS_FILE = "embeddings.npy"
+    CHUNKS_FILE = "chunks.json"
+    META_FILE = "meta.json"
+
+    def __init__(self, embedder, chunks=(), embeddings=None, batch_size=64, pages=None):
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.chunks = list(chunks)
+        # Page each chunk starts on, if known (see ChunkIndex)
+        self.pages = list(pages) if pages is not None else None
+        if embeddings is None:
+            embeddings = self._embed_chunks(self.chunks)
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _embed_chunks(self, chunks):
+        """Embed chunks batch by batch into a preallocated matrix."""
+        matrix = None
+        for start in range(0, len(chunks), self.batch_size):
+            batch = self.embedder.embed(chunks[start:start + self.batch_size])
+            if matrix is None:
+                matrix = np.empty((len(chunks), batch.shape[1]), dtype=np.float32)
+            matrix[start:start + len(batch)] = batch
+        if matrix is None:
+            matrix = np.empty((0, self.embedder.dim), dtype=np.float32)
+        return matrix
+
+    def scores(self, query):
+        """Return the cosine similarity of the query to every chunk."""
+        query_vector = self.embedder.embed([query])[0]
+        return self.embeddings @ query_vector
+
+    def search(self, query, top_k=4, with_pages=False):
+        """Return the top_k most similar chunks, in document order (or (chunk, page) pairs)."""
+        if not self.chunks:
+            return []
+        scores = self.scores(query)
+        top_k = min(top_k, len(self.chunks))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return select_chunks(self.chunks, self.pages, sorted(best.tolist()), with_pages)
+
+    def save(self, path):
+        """Write the index to a directory."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self.EMBEDDINGS_FILE), np.ascontiguousarray(self.embeddings))
+        with open(os.path.join(path, self.CHUNKS_FILE), 'w', encoding='utf-8') as file:
+            json.dump(self.chunks, file)
+        # Written last so a directory with meta.json is always complete
+        with open(os.path.join(path, self.META_FILE), 'w', encoding='utf-8') as file:
+            json.dump({"embedder": self.embedder.name, "count": len(self.chunks), "pages": self.pages}, file)
+
+    @classmethod
+    def load(cls, path, embedder):
+        """Open a saved index with its embeddings memory-mapped."""
+        with open(os.path.join(path, cls.META_FILE), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta["embedder"] != embedder.name:
+            raise ValueError(f"Index at {path} was built with {meta['embedder']}, not {embedder.name}")
+        with open(os.path.join(path, cls.CHUNKS_FILE), 'r', encoding='utf-8') as file:
+            chunks = json.load(file)
+        embeddings = np.load(os.path.join(path, cls.EMBEDDINGS_FILE), mmap_mode='r')
+        return cls(embedder, chunks, embeddings, pages=meta.get("pages"))
+
+    @classmethod
+    def load_or_build(cls, path, chunks, embedder, batch_size=64, pages=None):
+        """Load the index at path if present, otherwise build and save it."""
+        if os.path.exists(os.path.join(path, cls.META_FILE)):
+            try:
+                return cls.load(path, embedder)
+            except Exception as e:
+                print(f"Error loading embedding index at {path}: {str(e)}")
+        index = cls(embedder, chunks, batch_size=batch_size, pages=pages)
+        index.save(path)
+        return index
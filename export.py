@@ -0,0 +1,188 @@
+"""Export and import saved conversations as JSONL.
+
+Each conversation is one header line followed by one line per message:
+
+    {"conversation": {"id": "...", "title": "...", "model": "Llama3-8b", ...}}
+    {"role": "user", "content": "Hi"}
+    {"role": "assistant", "content": "Hello!", "stats": {...}}
+
+Files may be gzip-compressed. Both directions stream: messages are read
+from (or written to) the conversation store a batch at a time, so memory
+use doesn't grow with the number or length of conversations.
+
+Usage:
+    python export.py export conversations.jsonl.gz
+    python export.py import conversations.jsonl.gz --db conversations.db
+"""
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import uuid
+import zlib
+import secrets
+import argparse
+import threading
+from message_log import Message
+from metrics import register_route
+
+# Messages written to the store per transaction when importing
+IMPORT_BATCH_SIZE = 500
+
+# Bytes of JSONL gathered before each (compressed) chunk is handed out
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Seconds a download link stays valid
+EXPORT_LINK_TTL = 600
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+def iter_jsonl(store, conversation_ids=None):
+    """Yield the export one line at a time; all conversations if no ids are given."""
+    if conversation_ids is None:
+        conversations = store.iter_conversations()
+    else:
+        conversations = (conversation for conversation in map(store.get, conversation_ids) if conversation)
+    for conversation in conversations:
+        yield _dumps({"conversation": conversation}) + "\n"
+        for message in store.iter_messages(conversation["id"]):
+            yield _dumps(message.to_dict()) + "\n"
+
+def iter_export(store, conversation_ids=None, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export as chunks of bytes, gzip-compressed if compress is set."""
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for line in iter_jsonl(store, conversation_ids):
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+def import_conversations(store, file, batch_size=IMPORT_BATCH_SIZE):
+    """Load an export (plain or gzip JSONL, as a binary file) into the store.
+
+    Conversations with an id the store's owner already has are replaced;
+    one whose id belongs to another owner is stored under a new id.
+    Returns (conversations, messages) imported.
+    """
+    if file.read(2) == b"\x1f\x8b":
+        file.seek(0)
+        file = gzip.GzipFile(fileobj=file)
+    else:
+        file.seek(0)
+    lines = io.TextIOWrapper(file, encoding='utf-8')
+
+    conversation_count = 0
+    message_count = 0
+    conversation_id = None
+    saved = 0
+    batch = []
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number}: {str(e)}")
+        if "conversation" in record:
+            if batch:
+                store.append_messages(conversation_id, batch, saved)
+                batch = []
+            conversation = record["conversation"]
+            if not store.is_writable(conversation["id"]):
+                conversation = dict(conversation, id=str(uuid.uuid4()))
+            # Saving with no messages writes the metadata and clears any old messages
+            store.save(conversation, [])
+            conversation_id = conversation["id"]
+            saved = 0
+            conversation_count += 1
+            continue
+        if conversation_id is None:
+            raise ValueError(f"Line {line_number}: message before the first conversation header")
+        batch.append(Message(record["role"], record["content"], record.get("stats")))
+        message_count += 1
+        if len(batch) >= batch_size:
+            store.append_messages(conversation_id, batch, saved)
+            saved += len(batch)
+            batch = []
+    if batch:
+        store.append_messages(conversation_id, batch, saved)
+    lines.detach()
+    return conversation_count, message_count
+
+# Pending downloads: token -> (store, conversation ids or None, compress, expires_at)
+_links = {}
+_links_lock = threading.Lock()
+
+def create_download_link(store, conversation_ids=None, compress=True, ttl=EXPORT_LINK_TTL):
+    """Register an export and return the path the metrics server streams it from.
+
+    The path holds an unguessable token and stops working after ttl seconds.
+    """
+    token = secrets.token_urlsafe(16)
+    now = time.time()
+    with _links_lock:
+        for expired in [key for key, link in _links.items() if link[3] < now]:
+            del _links[expired]
+        _links[token] = (store, tuple(conversation_ids) if conversation_ids is not None else None,
+                         compress, now + ttl)
+    return f"/export/{token}"
+
+def _serve_export(path):
+    token = path[len("/export/"):]
+    with _links_lock:
+        link = _links.get(token)
+    if link is None or link[3] < time.time():
+        return 404, {"Content-Type": "text/plain"}, [b"Export link not found or expired\n"]
+    store, conversation_ids, compress, _ = link
+    file_name = "conversations.jsonl.gz" if compress else "conversations.jsonl"
+    headers = {
+        "Content-Type": "application/gzip" if compress else "application/x-ndjson",
+        "Content-Disposition": f'attachment; filename="{file_name}"',
+    }
+    return 200, headers, iter_export(store, conversation_ids, compress)
+
+register_route("/export/", _serve_export)
+
+def main(argv=None):
+    from conversation_store import ConversationStore
+
+    parser = argparse.ArgumentParser(description="Export or import saved conversations.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="JSONL file; a .gz suffix means gzip")
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB", "conversations.db"),
+                        help="Conversation database")
+    parser.add_argument("--id", action="append", dest="ids", help="Export only this conversation (repeatable)")
+    parser.add_argument("--owner", default="", help="Owner whose conversations are exported or imported")
+    args = parser.parse_args(argv)
+
+    store = ConversationStore(args.db, owner=args.owner)
+    if args.command == "export":
+        with open(args.path, 'wb') as file:
+            for chunk in iter_export(store, args.ids, compress=args.path.endswith(".gz")):
+                file.write(chunk)
+        print(f"Exported to {args.path}")
+    else:
+        with open(args.path, 'rb') as file:
+            conversations, messages = import_conversations(store, file)
+        print(f"Imported {conversations} conversations ({messages} messages)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import time
+import queue
+import asyncio
+import threading
+from metrics import LatencyHistogram
+
+_END = object()
+
+class LatencyTracker:
+    """Per-model time-to-first-token histograms, shared by every session."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model_id, seconds):
+        with self._lock:
+            histogram = self._histograms.get(model_id)
+            if histogram is None:
+                histogram = self._histograms[model_id] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def quantile(self, model_id, q, min_samples=20):
+        """Latency quantile for a model, or None until enough samples are in."""
+        with self._lock:
+            histogram = self._histograms.get(model_id)
+            if histogram is None or histogram.count < min_samples:
+                return None
+            return histogram.quantile(q)
+
+_tracker = LatencyTracker()
+
+def get_latency_tracker():
+    """The latency tracker shared by every handler in the process."""
+    return _tracker
+
+async def _pump(chunks, out):
+    """Copy an async stream into a queue, ending with _END or the raised exception."""
+    try:
+        async for chunk in chunks:
+            await out.put(chunk)
+        await out.put(_END)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await out.put(e)
+
+async def hedged_stream(contenders, deadline, observe=None):
+    """Stream from the first of several equivalent requests to produce output.
+
+    ``contenders`` is a list of ``(name, start)`` pairs where ``start()``
+    returns an async iterator of chunks; the first is the primary. The
+    primary is started straight away. If it hasn't produced a chunk within
+    ``deadline`` seconds (or fails before its first chunk), the next
+    contender is started. Whichever produces a chunk first wins; the others
+    are cancelled, which closes their HTTP streams.
+
+    Yields ``(name, chunk)`` pairs from the winner.
+
+    ``observe(name, seconds, lower_bound)`` is called with each contender's
+    time to first chunk, timed from its own start. A contender that was
+    started before the winner and loses without producing anything is
+    reported with the time it had waited so far and lower_bound set, so a
+    slow primary's samples aren't dropped just because a faster one won.
+    Contenders started after the winner are not reported when they lose:
+    their short wait says nothing about how slow they are.
+    """
+    running = {}
+    started = {}
+    pending = list(contenders)
+    errors = []
+    stopped = []
+
+    def start_next():
+        name, start = pending.pop(0)
+        out = asyncio.Queue()
+        started[name] = time.perf_counter()
+        running[name] = (asyncio.ensure_future(_pump(start(), out)), out)
+
+    def record(name, lower_bound=False):
+        if observe is not None:
+            observe(name, time.perf_counter() - started[name], lower_bound)
+
+    def cancel(names):
+        for name in names:
+            task, _ = running.pop(name)
+            task.cancel()
+            stopped.append(task)
+
+    start_next()
+    winner = None
+    first = None
+    getters = {}
+    try:
+        while winner is None:
+            getters = {asyncio.ensure_future(out.get()): name for name, (_, out) in running.items()}
+            timeout = deadline if pending else None
+            done, not_done = await asyncio.wait(getters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for getter in not_done:
+                getter.cancel()
+
+            if not done:
+                # Deadline passed without a first chunk: hedge with the next contender
+                start_next()
+                continue
+
+            answered = set()
+            for getter in done:
+                name = getters[getter]
+                item = getter.result()
+                if item is _END or isinstance(item, Exception):
+                    # Failed (or empty) before producing anything; drop it
+                    if isinstance(item, Exception):
+                        errors.append(item)
+                    cancel([name])
+                    continue
+                # If two produced a first chunk at once, the other is cancelled below
+                record(name)
+                answered.add(name)
+                if winner is None:
+                    winner, first = name, item
+            if winner is not None:
+                for name in running:
+                    if name not in answered and started[name] < started[winner]:
+                        record(name, lower_bound=True)
+
+            if winner is None and not running:
+                if not pending:
+                    if errors:
+                        raise errors[-1]
+                    return
+                start_next()
+
+        cancel([name for name in list(running) if name != winner])
+        yield winner, first
+
+        _, out = running[winner]
+        while True:
+            item = await out.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield winner, item
+    finally:
+        cancel(list(running))
+        for getter in getters:
+            getter.cancel()
+        # Wait for the cancelled requests to close their streams and leave the rate limit queue
+        await asyncio.gather(*stopped, *getters, return_exceptions=True)
+
+def iterate_in_loop(agen, loop):
+    """Consume an async iterator on ``loop`` (in another thread) as a sync iterator.
+
+    Closing the returned generator cancels the async side and waits for
+    it to finish cleaning up.
+    """
+    items = queue.Queue()
+    finished = threading.Event()
+
+    async def consume():
+        try:
+            async for item in agen:
+                items.put((True, item))
+            items.put((False, None))
+        except BaseException as e:
+            items.put((False, e))
+        finally:
+            await agen.aclose()
+            finished.set()
+
+    future = asyncio.run_coroutine_threadsafe(consume(), loop)
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                if isinstance(item, BaseException) and not isinstance(item, asyncio.CancelledError):
+                    raise item
+                return
+            yield item
+    finally:
+        future.cancel()
+        # Every exit follows at least one item, so consume() has started and will get here
+        finished.wait()
@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from client_pool import submit
+from doc_store import is_extraction_error
+from metrics import get_metrics
+
+# Files processed at the same time across all sessions
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Documents longer than this (in characters) also get a digest when a job has a summarizer
+SUMMARY_MIN_CHARS = int(os.getenv("SUMMARY_MIN_CHARS", 5000))
+
+QUEUED = "queued"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Thread pool shared by all ingestion jobs, created on first use.
+
+    Large PDFs are still split across the document module's process pool,
+    so threads here mostly wait on extraction and indexing.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+        return _pool
+
+def index_document(processor, text, embedder=None, cache_dir=None, page_offsets=None):
+    """Build the retrieval index for a document's text (BM25 unless an embedder is given).
+
+    The text is chunked lazily, so only the chunks kept by the index are
+    held alongside it. With page_offsets, chunks keep the page they
+    start on, so retrieved passages can be cited by page.
+    """
+    chunks = processor.iter_text_chunks(text, page_offsets)
+    if embedder is None:
+        return processor.build_index(chunks)
+    return processor.build_embedding_index(chunks, embedder, cache_dir=cache_dir)
+
+def ingest_file(uploaded_file, store, processor, embedder=None, cache_dir=None):
+    """Extract and index one upload.
+
+    Returns (text, index). Raises ValueError if extraction fails.
+    """
+    text, page_offsets = store.get_or_process(uploaded_file, processor)
+    if is_extraction_error(text):
+        raise ValueError(text)
+    return text, index_document(processor, text, embedder, cache_dir, page_offsets)
+
+class FileStatus:
+    """Progress of one file in an ingestion job."""
+
+    __slots__ = ("name", "size", "state", "error", "started_at", "finished_at")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.state = QUEUED
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+class IngestJob:
+    """A batch of uploads processed concurrently on the shared ingestion pool.
+
+    ``process(file)`` runs on a worker thread and returns (text, index),
+    like ingest_file. A file that raises is marked failed without
+    affecting the others.
+    Finished documents queue up until drain() is called, so the caller can
+    merge them into its own state on its own thread (Streamlit session
+    state must not be touched from worker threads).
+
+    With a summarize.Summarizer, long documents also get a digest. It is
+    started on the shared event loop once the document is indexed, so the
+    document can be used (and the worker moves on) while it is written;
+    finished digests queue up until drain_summaries() is called.
+    """
+
+    def __init__(self, files, process, summarizer=None):
+        self.files = [FileStatus(file.name, file.size if hasattr(file, 'size') else len(file.getvalue()))
+                      for file in files]
+        self.started_at = time.perf_counter()
+        self._process = process
+        self._summarizer = summarizer
+        self._lock = threading.Lock()
+        self._results = []
+        self._summaries = []
+        self._digests = []
+        # Digests whose result hasn't been queued (or dropped) yet
+        self._summarizing = 0
+        self._cancelled = False
+        pool = _get_pool()
+        self._futures = [pool.submit(self._run, status, file) for status, file in zip(self.files, files)]
+
+    def _run(self, status, file):
+        with self._lock:
+            if self._cancelled:
+                return
+            status.state = PROCESSING
+            status.started_at = time.perf_counter()
+        metrics = get_metrics()
+        try:
+            text, index = self._process(file)
+        except Exception as e:
+            print(f"Error processing file {status.name}: {str(e)}")
+            with self._lock:
+                status.state = FAILED
+                status.error = str(e)
+                status.finished_at = time.perf_counter()
+            metrics.inc("document_ingest_files_total", outcome="error")
+            return
+        with self._lock:
+            status.state = DONE
+            status.finished_at = time.perf_counter()
+            self._results.append((status.name, text, index))
+        metrics.inc("document_ingest_files_total", outcome="ok")
+        if self._summarizer is not None and len(text) > SUMMARY_MIN_CHARS:
+            digest = submit(self._summarizer.asummarize(text))
+            with self._lock:
+                self._digests.append(digest)
+                self._summarizing += 1
+                if self._cancelled:
+                    digest.cancel()
+            # Outside the lock: the callback runs straight away if the digest was cached
+            digest.add_done_callback(lambda future: self._digest_done(status.name, future))
+
+    def _digest_done(self, name, future):
+        summary = None
+        if not future.cancelled():
+            try:
+                summary = future.result()
+            except Exception as e:
+                # Retrieval still works without a digest
+                print(f"Error summarizing {name}: {str(e)}")
+        # Counted down only once the summary is queued, so done never runs ahead of drain_summaries()
+        with self._lock:
+            if summary is not None:
+                self._summaries.append((name, summary))
+            self._summarizing -= 1
+
+    def drain(self):
+        """Return the (name, text, index) of documents finished since the last call."""
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def drain_summaries(self):
+        """Return the (name, summary) of digests finished since the last call."""
+        with self._lock:
+            summaries, self._summaries = self._summaries, []
+        return summaries
+
+    def cancel(self):
+        """Skip the files that haven't started and stop digests; files already processing still finish."""
+        with self._lock:
+            self._cancelled = True
+            for status in self.files:
+                if status.state == QUEUED:
+                    status.state = CANCELLED
+            digests = list(self._digests)
+        for future in self._futures + digests:
+            future.cancel()
+
+    @property
+    def done(self):
+        """True once every file is processed and every digest finished.
+
+        Everything the job produces is queued for drain() and
+        drain_summaries() by then.
+        """
+        return all(future.done() for future in self._futures) and self.summarizing == 0
+
+    @property
+    def summarizing(self):
+        """Number of digests still being written."""
+        with self._lock:
+            return self._summarizing
+
+    def counts(self):
+        """Number of files in each state."""
+        with self._lock:
+            counts = {QUEUED: 0, PROCESSING: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+            for status in self.files:
+                counts[status.state] += 1
+        return counts
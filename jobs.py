@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from client_pool import submit
+from metrics import get_metrics
+
+class GenerationJob:
+    """One streamed reply generated as a task on the shared event loop.
+
+    The Streamlit script starts a job and returns straight away; the UI
+    polls ``text`` while the reply comes in, so neither the script thread
+    nor any other thread is blocked on the provider. cancel() stops the
+    job straight away, even while the request is queued for rate limits
+    or waiting for its first byte: the task is cancelled, which closes its
+    HTTP stream, and the handler keeps the partial reply in the history
+    marked as truncated.
+
+    The handler must not be used for another turn until the job is done,
+    since the job appends to its message log.
+    """
+
+    def __init__(self, handler, **request):
+        self.handler = handler
+        self.user_input = request["user_input"]
+        # Where this turn starts in the conversation; the handler appends the question and reply
+        self.log_start = len(handler.message_log)
+        self.stats = None
+        self.error = None
+        self._parts = []
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._started = threading.Event()
+        self._done = threading.Event()
+        self._future = None
+        try:
+            # Prompt assembly and retrieval run here rather than on the loop
+            stream = handler.astream_response(**request)
+        except Exception as e:
+            self._fail(e)
+            self._finish("error")
+            return
+        self._future = submit(self._run(stream))
+        # A task cancelled before its first step skips its cleanup, so let it start (the loop picks it up at once)
+        self._started.wait()
+
+    async def _run(self, stream):
+        self._started.set()
+        outcome = "completed"
+        try:
+            async for text in stream:
+                with self._lock:
+                    self._parts.append(text)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "error"
+            self._fail(e)
+        finally:
+            await stream.aclose()
+            self._finish(outcome)
+
+    def _fail(self, e):
+        self.error = f"Error generating response: {str(e)}"
+        print(self.error)
+
+    def _finish(self, outcome):
+        self.stats = self.handler.last_response_stats
+        get_metrics().inc("llm_generation_jobs_total", outcome=outcome)
+        self._done.set()
+
+    @property
+    def text(self):
+        """The reply so far."""
+        with self._lock:
+            return "".join(self._parts)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """Stop the job; wait() returns once the partial reply is in the history."""
+        self._cancelled = True
+        if self._future is not None:
+            self._future.cancel()
+
+    def wait(self, timeout=None):
+        """Block until the job is done; returns False on timeout."""
+        return self._done.wait(timeout)
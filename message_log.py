@@ -0,0 +1,73 @@
+import sys
+
+# Roles are interned so every message shares one string object per role
+SYSTEM = sys.intern("system")
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+class Message:
+    """One chat turn: role, text and optional reply stats."""
+
+    __slots__ = ("role", "content", "stats")
+
+    def __init__(self, role, content, stats=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.stats = stats
+
+    @property
+    def failed(self):
+        """True for error text shown in place of a reply (never sent to the model)."""
+        return bool(self.stats) and self.stats.get("error", False)
+
+    def to_dict(self):
+        message = {"role": self.role, "content": self.content}
+        if self.stats:
+            message["stats"] = self.stats
+        return message
+
+    def to_langchain(self):
+        """Build the LangChain message for a request."""
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+        if self.role == USER:
+            return HumanMessage(content=self.content)
+        if self.role == ASSISTANT:
+            return AIMessage(content=self.content)
+        return SystemMessage(content=self.content)
+
+class MessageLog:
+    """The turns of one conversation, shared by the UI and LLMHandler.
+
+    Each turn is stored once as a slotted Message. LangChain message
+    objects are only built for the turns sent with a request.
+
+    The log is append-only. ``version`` counts appends, and mark_saved()
+    records the version and length last written to the conversation store,
+    so saving again only needs to write the turns added since.
+    """
+
+    def __init__(self, messages=None):
+        self.messages = list(messages or [])
+        self.version = 0
+        self.saved_version = None
+        self.saved_count = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def append(self, role, content, stats=None):
+        message = Message(role, content, stats)
+        self.messages.append(message)
+        self.version += 1
+        return message
+
+    def mark_saved(self):
+        """Record that everything up to now is in the conversation store."""
+        self.saved_version = self.version
+        self.saved_count = len(self.messages)
@@ -0,0 +1,197 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0,
+                   3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of latencies in seconds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus an overflow bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the q-th quantile, or None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.buckets[-1] * 2
+        return self.buckets[-1] * 2
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Metrics:
+    """Process-wide timing histograms and counters.
+
+    Recording a span is a perf_counter call plus a locked bucket increment,
+    cheap enough to leave on in production. Everything can be read back
+    as a dict (for the in-app diagnostics panel) or rendered in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> {label_key: LatencyHistogram}
+        self._histograms = {}
+        # name -> {label_key: value}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in seconds."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block and record it under name."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def snapshot(self):
+        """Summaries of every series, for display."""
+        with self._lock:
+            spans = [
+                {"name": name, "labels": dict(key), "count": histogram.count,
+                 "mean_ms": histogram.total / histogram.count * 1000 if histogram.count else 0.0,
+                 "p95_ms": (histogram.quantile(0.95) or 0.0) * 1000}
+                for name, series in sorted(self._histograms.items())
+                for key, histogram in series.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(key), "value": value}
+                for name, series in sorted(self._counters.items())
+                for key, value in series.items()
+            ]
+        return {"spans": spans, "counters": counters}
+
+    def render_prometheus(self):
+        """All series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the exposition text to a file (e.g. for node_exporter's textfile collector)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+_metrics = Metrics()
+
+def get_metrics():
+    """The metrics registry shared by the whole process."""
+    return _metrics
+
+# Extra GET routes served next to /metrics: path prefix -> handler(path)
+_routes = {}
+
+def register_route(prefix, handler):
+    """Serve GET requests whose path starts with prefix from the metrics server.
+
+    ``handler(path)`` returns ``(status, headers, chunks)``; the body is
+    streamed from the ``chunks`` iterable of bytes as it is produced.
+    """
+    _routes[prefix] = handler
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = _metrics.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        handler = next((handler for prefix, handler in _routes.items() if path.startswith(prefix)), None)
+        if handler is None:
+            self.send_error(404)
+            return
+        status, headers, chunks = handler(path)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        # No Content-Length: the connection is closed once the last chunk is written
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-download
+            pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics (and registered routes) on a background thread.
+
+    Only the first call starts a server.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
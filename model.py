@@ -1,8 +1,17 @@
 import os
-from langchain_groq import ChatGroq
-from langchain.memory import ChatMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+import asyncio
+from client_pool import get_chat_client, get_event_loop
+from token_budget import TokenBudget, estimate_tokens
+from prompt import PromptAssembler
+from message_log import MessageLog, USER, ASSISTANT
+from scheduler import get_scheduler
+from hedging import get_latency_tracker, hedged_stream, iterate_in_loop
+from metrics import get_metrics
 import json
+import time
+
+async def _single(text):
+    yield text
 
 class LLMHandler:
     def __init__(self):
@@ -20,10 +29,50 @@ class LLMHandler:
             "Llama3-8b": "groq",
         }
         
+        # Context window size (in tokens) of each model
+        self.context_windows = {
+            "Llama2-70b": 4096,
+            "Mixtral 8x7B": 32768,
+            "Llama3-8b": 8192,
+        }
+        
+        # Optional cap on history tokens below what the context window allows
+        max_history_tokens = os.environ.get("MAX_HISTORY_TOKENS")
+        self.max_history_tokens = int(max_history_tokens) if max_history_tokens else None
+        self.token_budget = TokenBudget()
+        
         self.current_model = None
-        self.message_history = ChatMessageHistory()
+        # Conversation turns, shared with the UI; LangChain messages are built per request
+        self.message_log = MessageLog()
         self.llm = None
+        self._api_token = None
         self.provider = "groq"  # Always groq
+        self.last_response_stats = None
+        
+        # Process-wide rate limit scheduler; lower priority values are served first
+        self.scheduler = get_scheduler()
+        self.request_priority = 0
+        
+        # Opt-in hedging across models (see enable_hedging) and the shared
+        # time-to-first-token histograms its deadlines adapt to
+        self.hedging = None
+        self.latency_tracker = get_latency_tracker()
+        self.last_response_model = None
+        
+        # Process-wide stage timings and token counters
+        self.metrics = get_metrics()
+        
+        # Optional response cache, used at temperature 0 unless opted in for all
+        self.response_cache = None
+        self.cache_all_temperatures = False
+        self._cache_key = None
+        
+        # Assembled context for documents that don't depend on the question
+        self._static_context_key = None
+        self._static_context = ""
+        
+        # Prompt layout and prefix-reuse tracking
+        self.prompt_assembler = PromptAssembler()
         
         # Get API key from environment
         self.groq_api_key = os.environ.get("GROQ_API_KEY")
@@ -43,13 +92,10 @@ class LLMHandler:
             raise ValueError("Please provide a Groq API key in .env file or through the UI")
         
         try:
-            # Initialize the LLM with ChatGroq
-            self.llm = ChatGroq(
-                model_name=model_id,
-                groq_api_key=api_token,
-                temperature=float(os.environ.get("DEFAULT_TEMPERATURE", 0.7)),
-                max_tokens=int(os.environ.get("DEFAULT_MAX_TOKENS", 1024))
-            )
+            # Reuse the process-wide ChatGroq client (and its connection pool)
+            # for this model and key instead of building one per session
+            self.llm = get_chat_client(model_id, api_token)
+            self._api_token = api_token
             
             self.current_model = model_name
             return True
@@ -58,50 +104,456 @@ class LLMHandler:
             print(f"Error initializing Groq model: {str(e)}")
             return False
             
-    def generate_response(self, user_input, system_message="You are a helpful assistant.", 
-                         temperature=0.7, max_tokens=1024, context_docs=None):
+    def enable_hedging(self, fallback_model, deadline=2.0, min_deadline=0.25):
+        """Send a duplicate request to fallback_model when the primary is slow.
+
+        If the current model hasn't produced a first token within the
+        deadline, the same request is sent to the fallback model and the
+        first to respond wins. Once enough replies have been timed, the
+        deadline follows the primary model's observed p95 time to first
+        token (but never drops below min_deadline).
+        """
+        if fallback_model not in self.available_models:
+            raise ValueError(f"Model {fallback_model} not found in available models")
+        self.hedging = {"fallback_model": fallback_model, "deadline": deadline, "min_deadline": min_deadline}
+    
+    def disable_hedging(self):
+        self.hedging = None
+    
+    def _hedge_deadline(self, model_id):
+        p95 = self.latency_tracker.quantile(model_id, 0.95)
+        if p95 is None:
+            return self.hedging["deadline"]
+        return max(self.hedging["min_deadline"], p95)
+    
+    def _race(self, request_messages, temperature, max_tokens):
+        """Return an async iterator of (model_id, chunk), hedged across models if enabled.
+
+        Iterate it on the shared event loop. Cancelling it abandons the
+        request at once, whether it is waiting in the rate limit queue,
+        waiting for the first byte or streaming, and closes its HTTP stream.
+        """
+        model_id = self._model_id()
+        tokens = self._request_tokens(request_messages, max_tokens)
+        self.last_response_model = model_id
+        
+        def start(contender_id, llm):
+            async def chunks():
+                async for chunk in self.scheduler.astream(
+                    contender_id, tokens,
+                    lambda: llm.astream(request_messages, temperature=temperature, max_tokens=max_tokens),
+                    self.request_priority
+                ):
+                    # The first chunk is often an empty role header; only text counts as a first token.
+                    # The last one may be empty apart from the usage report.
+                    if chunk.content or chunk.usage_metadata:
+                        yield chunk
+            return chunks()
+        
+        def observe(contender_id, seconds, lower_bound):
+            # Each model's own time to first token, so a primary that keeps losing still pushes its deadline up
+            self.latency_tracker.observe(contender_id, seconds)
+            if not lower_bound:
+                self.metrics.observe("llm_time_to_first_token_seconds", seconds, model=contender_id)
+        
+        # Without a fallback this is a race of one, which still times the first token
+        contenders = [(model_id, lambda: start(model_id, self.llm))]
+        deadline = None
+        fallback_id = self.available_models[self.hedging["fallback_model"]] if self.hedging else None
+        if fallback_id and fallback_id != model_id:
+            fallback_llm = get_chat_client(fallback_id, self._api_token)
+            contenders.append((fallback_id, lambda: start(fallback_id, fallback_llm)))
+            deadline = self._hedge_deadline(model_id)
+        return hedged_stream(contenders, deadline, observe)
+    
+    def _stream_chunks(self, request_messages, temperature, max_tokens):
+        """Yield response chunks from the provider, hedged across models if enabled."""
+        race = self._race(request_messages, temperature, max_tokens)
+        for winner_id, chunk in iterate_in_loop(race, get_event_loop()):
+            self.last_response_model = winner_id
+            yield chunk
+    
+    def _build_context(self, user_input, context_docs, doc_indexes=None, top_k=4, doc_summaries=None):
+        """Return (document_context, retrieved_context) for one request.
+
+        Documents without an index don't depend on the question, so their
+        block is assembled once (in canonical order) and reused until
+        context_docs changes. The digest of a summarized document is
+        question-independent too and goes in the same block. Indexed
+        documents contribute the chunks retrieved for this question, which
+        go with the new turn.
+        """
+        if not context_docs:
+            return "", ""
+        
+        doc_indexes = doc_indexes or {}
+        doc_summaries = doc_summaries or {}
+        static_docs = tuple((name, content) for name, content in context_docs.items()
+                            if name not in doc_indexes)
+        static_docs += tuple((f"{name} (summary)", doc_summaries[name]) for name in context_docs
+                             if name in doc_indexes and doc_summaries.get(name))
+        if static_docs != self._static_context_key:
+            self._static_context_key = static_docs
+            self._static_context = self.prompt_assembler.document_context(static_docs)
+        
+        # Only send the chunks relevant to this question for indexed documents, labelled with their page if known
+        retrieved = "".join(
+            f"From {doc_name}:\n" + "\n...\n".join(
+                f"[Page {page + 1}] {chunk}" if page is not None else chunk
+                for chunk, page in doc_indexes[doc_name].search(user_input, top_k, with_pages=True)
+            ) + "\n\n"
+            for doc_name in sorted(context_docs) if doc_name in doc_indexes
+        )
+        if retrieved:
+            retrieved = "Context retrieved for this question:\n" + retrieved
+        return self._static_context, retrieved
+    
+    def _prepare_request(self, user_input, system_message, temperature, max_tokens, context_docs,
+                         doc_indexes=None, top_k=4, doc_summaries=None):
+        """Record the user turn and return the messages to send.
+
+        The layout (see prompt.PromptAssembler) keeps everything before
+        this question's retrieved chunks stable between turns. Context is
+        never written into the log, so earlier turns don't carry copies of
+        the documents.
+        """
         if not self.llm:
             raise ValueError("Model not initialized. Call initialize_model first.")
         
-        # Update model parameters
-        self.llm.temperature = temperature
-        self.llm.max_tokens = max_tokens
+        # Add the user message to the log
+        log = self.message_log
+        log.append(USER, user_input)
         
-        # Optional context
-        context = ""
-        if context_docs:
-            context = "\nContext information:\n"
-            for doc_name, doc_content in context_docs.items():
-                context += f"From {doc_name}:\n{doc_content}\n\n"
+        with self.metrics.span("llm_prompt_assembly_seconds"):
+            document_context, retrieved_context = self._build_context(user_input, context_docs, doc_indexes,
+                                                                      top_k, doc_summaries)
+            context = document_context + retrieved_context
+            budget = self._history_budget(max_tokens, context) - self.token_budget.text_tokens(system_message)
+            omitted, kept = self.token_budget.fit(log.messages, budget)
+            prompt = self.prompt_assembler.assemble(system_message, document_context, kept[:-1], omitted,
+                                                    retrieved_context, user_input)
+            messages = [message.to_langchain() for message in prompt]
+        self.metrics.inc("llm_prompt_prefix_reused_tokens_total", self.prompt_assembler.last_reused_tokens)
         
-        # Add the system message if it's not already in the history
-        messages = self.message_history.messages
-        if not messages or not isinstance(messages[0], SystemMessage):
-            self.message_history.add_message(SystemMessage(content=system_message))
+        self._cache_key = None
+        if self.response_cache is not None and (temperature == 0 or self.cache_all_temperatures):
+            self._cache_key = self.response_cache.make_key(
+                self._model_id(), temperature, max_tokens,
+                system_message, log.messages[:-1], context, user_input
+            )
+        return messages
+    
+    def _model_id(self):
+        """Provider model id of the current client."""
+        return getattr(self.llm, "model_name", None) or self.available_models.get(self.current_model)
+    
+    def _request_tokens(self, request_messages, max_tokens):
+        """Tokens a request may use, for rate limiting: prompt estimate plus max_tokens."""
+        return sum(estimate_tokens(message.content) for message in request_messages) + max_tokens
+    
+    def _record_usage(self, model_id, request_messages, usage, content, outcome="ok", chunk_count=None):
+        """Count a reply's prompt and completion tokens.
+
+        Uses the provider's usage report when there is one and falls back
+        to estimates otherwise; for a streamed reply the number of chunks
+        is the completion estimate. Returns (prompt_tokens, completion_tokens).
+        """
+        if usage:
+            prompt_tokens = usage.get("input_tokens", 0)
+            completion_tokens = usage.get("output_tokens", 0)
+        else:
+            prompt_tokens = sum(estimate_tokens(message.content) for message in request_messages)
+            completion_tokens = chunk_count if chunk_count is not None else estimate_tokens(content)
+        self.metrics.inc("llm_requests_total", model=model_id, outcome=outcome)
+        self.metrics.inc("llm_prompt_tokens_total", prompt_tokens, model=model_id)
+        self.metrics.inc("llm_completion_tokens_total", completion_tokens, model=model_id)
+        return prompt_tokens, completion_tokens
+    
+    def _cached_response(self, user_input):
+        """Return the cached reply for the prepared request, if any."""
+        if self._cache_key is None:
+            return None
+        scope, key = self._cache_key
+        cached = self.response_cache.get(scope, key, user_input)
+        if cached is not None:
+            self.metrics.inc("llm_requests_total", model=self._model_id(), outcome="cache_hit")
+        return cached
+    
+    def _cache_response(self, user_input, content, latency):
+        """Store a freshly generated reply for the prepared request."""
+        if self._cache_key is None:
+            return
+        scope, key = self._cache_key
+        self.response_cache.put(scope, key, content, latency, user_input)
+    
+    def _history_budget(self, max_tokens, context):
+        """Tokens left for the conversation history in this request."""
+        window = self.context_windows.get(self.current_model, 4096)
+        budget = window - max_tokens - (estimate_tokens(context) if context else 0)
+        if self.max_history_tokens:
+            budget = min(budget, self.max_history_tokens)
+        return budget
+    
+    def generate_response(self, user_input, system_message="You are a helpful assistant.", 
+                         temperature=0.7, max_tokens=1024, context_docs=None,
+                         doc_indexes=None, top_k=4, doc_summaries=None):
+        request_messages = self._prepare_request(user_input, system_message, temperature, max_tokens,
+                                                 context_docs, doc_indexes, top_k, doc_summaries)
         
-        # Add the user message to history
-        full_input = context + user_input if context else user_input
-        self.message_history.add_message(HumanMessage(content=full_input))
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            self.message_log.append(ASSISTANT, cached)
+            return cached
         
         try:
-            # Generate response using the message history directly
-            response = self.llm.invoke(self.message_history.messages)
-            
-            # Extract the content from the response
-            if hasattr(response, 'content'):
-                content = response.content
+            # Generate response from the history plus this request's context
+            # Settings go with the call since the client is shared between sessions
+            started_at = time.perf_counter()
+            model_id = self._model_id()
+            usage = None
+            if self.hedging:
+                # Hedging races streams, so collect the winning stream's text
+                parts = []
+                for chunk in self._stream_chunks(request_messages, temperature, max_tokens):
+                    parts.append(chunk.content)
+                    usage = chunk.usage_metadata or usage
+                content = "".join(parts)
+                model_id = self.last_response_model
             else:
-                # Fallback for unexpected response format
-                content = str(response)
+                response = self.scheduler.run(
+                    model_id, self._request_tokens(request_messages, max_tokens),
+                    lambda: self.llm.invoke(request_messages, temperature=temperature, max_tokens=max_tokens),
+                    self.request_priority
+                )
+                
+                # Extract the content from the response
+                if hasattr(response, 'content'):
+                    content = response.content
+                    usage = getattr(response, 'usage_metadata', None)
+                else:
+                    # Fallback for unexpected response format
+                    content = str(response)
+            latency = time.perf_counter() - started_at
+            self.metrics.observe("llm_request_seconds", latency, model=model_id, mode="invoke")
+            self._record_usage(model_id, request_messages, usage, content)
             
-            # Add the AI response to history
-            self.message_history.add_message(AIMessage(content=content))
+            # Add the AI response to the log
+            self.message_log.append(ASSISTANT, content)
+            self._cache_response(user_input, content, latency)
             
             return content
         except Exception as e:
+            self.metrics.inc("llm_requests_total", model=self._model_id(), outcome="error")
             error_msg = f"Error generating response: {str(e)}"
             print(error_msg)
+            # Shown in the conversation, but never sent back to the model
+            self.message_log.append(ASSISTANT, error_msg, {"error": True})
             return error_msg
     
+    async def agenerate_response(self, user_input, system_message="You are a helpful assistant.",
+                                 temperature=0.7, max_tokens=1024, context_docs=None,
+                                 doc_indexes=None, top_k=4, doc_summaries=None):
+        """Async version of generate_response.
+
+        Waiting on the provider doesn't hold a thread, so many sessions can
+        have requests in flight on one event loop (see client_pool.submit).
+        """
+        request_messages = self._prepare_request(user_input, system_message, temperature, max_tokens,
+                                                 context_docs, doc_indexes, top_k, doc_summaries)
+        
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            self.message_log.append(ASSISTANT, cached)
+            return cached
+        
+        try:
+            started_at = time.perf_counter()
+            model_id = self._model_id()
+            response = await self.scheduler.arun(
+                model_id, self._request_tokens(request_messages, max_tokens),
+                lambda: self.llm.ainvoke(request_messages, temperature=temperature, max_tokens=max_tokens),
+                self.request_priority
+            )
+            content = response.content if hasattr(response, 'content') else str(response)
+            latency = time.perf_counter() - started_at
+            self.metrics.observe("llm_request_seconds", latency, model=model_id, mode="ainvoke")
+            self._record_usage(model_id, request_messages, getattr(response, 'usage_metadata', None), content)
+            
+            # Add the AI response to the log
+            self.message_log.append(ASSISTANT, content)
+            self._cache_response(user_input, content, latency)
+            
+            return content
+        except Exception as e:
+            self.metrics.inc("llm_requests_total", model=self._model_id(), outcome="error")
+            error_msg = f"Error generating response: {str(e)}"
+            print(error_msg)
+            # Shown in the conversation, but never sent back to the model
+            self.message_log.append(ASSISTANT, error_msg, {"error": True})
+            return error_msg
+    
+    def stream_response(self, user_input, system_message="You are a helpful assistant.",
+                        temperature=0.7, max_tokens=1024, context_docs=None,
+                        doc_indexes=None, top_k=4, doc_summaries=None):
+        """Generate a response token by token.
+
+        Yields text fragments as the provider sends them. Once the stream is
+        exhausted the full reply is added to the message history and timing
+        stats are available in ``self.last_response_stats``.
+
+        Closing the generator early aborts the provider request, which
+        closes its HTTP stream, and keeps what arrived so far in the
+        history with ``truncated`` set in its stats.
+        """
+        yield from iterate_in_loop(
+            self.astream_response(user_input, system_message, temperature, max_tokens,
+                                  context_docs, doc_indexes, top_k, doc_summaries),
+            get_event_loop()
+        )
+    
+    def astream_response(self, user_input, system_message="You are a helpful assistant.",
+                         temperature=0.7, max_tokens=1024, context_docs=None,
+                         doc_indexes=None, top_k=4, doc_summaries=None):
+        """Async version of stream_response.
+
+        The request is prepared on the calling thread; the returned async
+        iterator must be consumed on the shared event loop. Cancelling the
+        task consuming it works like closing stream_response early.
+        """
+        request_messages = self._prepare_request(user_input, system_message, temperature, max_tokens,
+                                                 context_docs, doc_indexes, top_k, doc_summaries)
+        # The reply goes to this conversation even if another is opened while it streams
+        log = self.message_log
+        
+        cached = self._cached_response(user_input)
+        if cached is not None:
+            log.append(ASSISTANT, cached)
+            self.last_response_stats = None
+            return _single(cached)
+        return self._astream(log, user_input, request_messages, temperature, max_tokens)
+    
+    async def _astream(self, log, user_input, request_messages, temperature, max_tokens):
+        parts = []
+        chunk_count = 0
+        usage = None
+        first_token_at = None
+        started_at = time.perf_counter()
+        race = self._race(request_messages, temperature, max_tokens)
+        try:
+            async for winner_id, chunk in race:
+                self.last_response_model = winner_id
+                text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                # Groq reports usage on the final (empty) chunk
+                usage = getattr(chunk, 'usage_metadata', None) or usage
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                # Groq sends roughly one token per chunk
+                chunk_count += 1
+                parts.append(text)
+                yield text
+        except (asyncio.CancelledError, GeneratorExit):
+            # Stopped by the caller: cancel the provider request now rather than when it's collected
+            await race.aclose()
+            self._finish_stream(log, user_input, request_messages, "".join(parts), usage,
+                                started_at, first_token_at, chunk_count, truncated=True)
+            raise
+        except Exception as e:
+            self.metrics.inc("llm_requests_total", model=self._model_id(), outcome="error")
+            error_msg = f"Error generating response: {str(e)}"
+            print(error_msg)
+            log.append(ASSISTANT, error_msg, {"error": True})
+            self.last_response_stats = None
+            yield error_msg
+            return
+        
+        self._finish_stream(log, user_input, request_messages, "".join(parts), usage,
+                            started_at, first_token_at, chunk_count)
+    
+    def _finish_stream(self, log, user_input, request_messages, content, usage, started_at, first_token_at,
+                       chunk_count, truncated=False):
+        """Add a streamed reply to the log and record its stats.
+
+        Throughput uses the provider's completion token count; the number
+        of streamed chunks stands in only when it reports no usage.
+        """
+        finished_at = time.perf_counter()
+        
+        # Add the AI response to the log; its stats are filled in below.
+        # A truncated reply is kept for the conversation but never cached.
+        message = log.append(ASSISTANT, content)
+        if not truncated:
+            self._cache_response(user_input, content, finished_at - started_at)
+        
+        model_id = self.last_response_model
+        self.metrics.observe("llm_request_seconds", finished_at - started_at, model=model_id, mode="stream")
+        prompt_tokens, completion_tokens = self._record_usage(model_id, request_messages, usage, content,
+                                                              "cancelled" if truncated else "ok", chunk_count)
+        self.last_response_stats = self._response_stats(started_at, first_token_at, finished_at, completion_tokens)
+        self.last_response_stats["model"] = model_id
+        self.last_response_stats["prompt_tokens"] = prompt_tokens
+        self.last_response_stats["completion_tokens"] = completion_tokens
+        if truncated:
+            self.last_response_stats["truncated"] = True
+        message.stats = self.last_response_stats
+    
+    async def acomplete(self, messages, temperature=0.0, max_tokens=512, priority=None):
+        """Run a one-off request outside the conversation and return the reply text.
+
+        ``messages`` are message_log.Message records. Nothing is read from or
+        written to the message log or the response cache, so this is safe to
+        call concurrently with chat turns (e.g. for summarization). Errors
+        are raised to the caller.
+        """
+        if not self.llm:
+            raise ValueError("Model not initialized. Call initialize_model first.")
+        request_messages = [message.to_langchain() for message in messages]
+        model_id = self._model_id()
+        started_at = time.perf_counter()
+        try:
+            response = await self.scheduler.arun(
+                model_id, self._request_tokens(request_messages, max_tokens),
+                lambda: self.llm.ainvoke(request_messages, temperature=temperature, max_tokens=max_tokens),
+                self.request_priority if priority is None else priority
+            )
+        except Exception:
+            self.metrics.inc("llm_requests_total", model=model_id, outcome="error")
+            raise
+        content = response.content if hasattr(response, 'content') else str(response)
+        self.metrics.observe("llm_request_seconds", time.perf_counter() - started_at, model=model_id, mode="complete")
+        self._record_usage(model_id, request_messages, getattr(response, 'usage_metadata', None), content)
+        return content
+    
+    def _response_stats(self, started_at, first_token_at, finished_at, token_count):
+        """Build time-to-first-token and throughput stats for one reply."""
+        if first_token_at is None:
+            first_token_at = finished_at
+        generation_time = finished_at - first_token_at
+        return {
+            "time_to_first_token": first_token_at - started_at,
+            "total_time": finished_at - started_at,
+            "tokens": token_count,
+            "tokens_per_sec": token_count / generation_time if generation_time > 0 else 0.0,
+        }
+    
     def reset_memory(self):
-        self.message_history = ChatMessageHistory()
\ No newline at end of file
+        self.message_log = MessageLog()
+        self.token_budget = TokenBudget()
+    
+    def load_messages(self, messages):
+        """Replace the log with saved messages (message_log.Message records)."""
+        self.message_log = MessageLog(messages)
+        self.token_budget = TokenBudget()
+    
+    def snapshot(self):
+        """The current conversation state, to hand back to restore() later.
+
+        Nothing is copied: the log and its token counts are detached as they
+        are, and a fresh conversation should be started or restored next.
+        """
+        return self.message_log, self.token_budget
+    
+    def restore(self, snapshot):
+        """Switch to a conversation returned by snapshot(), in constant time."""
+        self.message_log, self.token_budget = snapshot
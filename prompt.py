@@ -0,0 +1,104 @@
+import hashlib
+from message_log import Message, SYSTEM, USER
+from token_budget import OMITTED_NOTE, MESSAGE_OVERHEAD, estimate_tokens
+
+def _chain(digest, message):
+    """Digest of everything up to and including message, given the digest before it."""
+    h = hashlib.blake2b(digest, digest_size=16)
+    h.update(message.role.encode('utf-8'))
+    h.update(b"\0")
+    h.update(message.content.encode('utf-8'))
+    return h.digest()
+
+class PromptAssembler:
+    """Lays requests out so consecutive ones share the longest possible prefix.
+
+    Messages are always in this order:
+
+        system prompt
+        documents that don't depend on the question, sorted by name
+        note about omitted turns (only while history is trimmed)
+        history
+        chunks retrieved for this question
+        the new user turn
+
+    Everything before the retrieved chunks is byte-for-byte identical from
+    one request to the next unless the settings, the documents or the
+    trimmed history change, so provider-side prompt caching (and any
+    local cache keyed on the prefix) can reuse it.
+
+    Each assembled request is compared with the previous one, message by
+    message, to track how many prompt tokens were a repeat of an already
+    sent prefix.
+    """
+
+    def __init__(self):
+        # Chained digests and token counts of the previous request's messages
+        self._previous = []
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.reused_tokens = 0
+        self.last_reused_tokens = 0
+        self.last_fingerprint = None
+
+    @staticmethod
+    def document_context(documents):
+        """Context block for question-independent documents, in canonical (name) order."""
+        if not documents:
+            return ""
+        return "Context information:\n" + "".join(
+            f"From {name}:\n{content}\n\n" for name, content in sorted(documents)
+        )
+
+    def assemble(self, system_prompt, document_context, history, omitted, retrieved_context, user_input):
+        """Return the request as a list of Message records.
+
+        ``history`` is the kept part of the conversation log, excluding the
+        new turn; ``omitted`` is how many earlier turns were left out.
+        """
+        prefix = [Message(SYSTEM, system_prompt)]
+        if document_context:
+            prefix.append(Message(SYSTEM, document_context))
+        if omitted:
+            prefix.append(Message(SYSTEM, OMITTED_NOTE.format(omitted)))
+        prefix.extend(message for message in history if not message.failed)
+
+        new_turn = []
+        if retrieved_context:
+            new_turn.append(Message(SYSTEM, retrieved_context))
+        new_turn.append(Message(USER, user_input))
+
+        self._observe(prefix, new_turn)
+        return prefix + new_turn
+
+    def _observe(self, prefix, new_turn):
+        digest = b""
+        current = []
+        for message in prefix + new_turn:
+            digest = _chain(digest, message)
+            current.append((digest, estimate_tokens(message.content) + MESSAGE_OVERHEAD))
+            if len(current) == len(prefix):
+                self.last_fingerprint = digest.hex()
+
+        reused = 0
+        for (digest, tokens), (previous_digest, _) in zip(current, self._previous):
+            if digest != previous_digest:
+                break
+            reused += tokens
+
+        self._previous = current
+        self.requests += 1
+        self.prompt_tokens += sum(tokens for _, tokens in current)
+        self.reused_tokens += reused
+        self.last_reused_tokens = reused
+
+    def stats(self):
+        """Prefix reuse across the requests assembled so far."""
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "reused_tokens": self.reused_tokens,
+            "reuse_ratio": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "last_reused_tokens": self.last_reused_tokens,
+            "last_fingerprint": self.last_fingerprint,
+        }
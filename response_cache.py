@@ -0,0 +1,216 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# Disk entries over the limit are pruned once every this many writes
+_PRUNE_INTERVAL = 256
+
+def _hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def hash_messages(messages):
+    """Hash the role and content of a list of messages."""
+    return _hash(json.dumps([[message.role, message.content] for message in messages]))
+
+class ResponseCache:
+    """Cache of LLM responses for repeated requests.
+
+    Exact tier: responses keyed by a hash of the model id, temperature,
+    max_tokens, system prompt, history, document context and user input,
+    held in an LRU with a TTL. With ``persist_path`` set, entries are also
+    kept in a SQLite file and survive restarts.
+
+    Semantic tier (optional, needs an ``embedder``): when the exact lookup
+    misses, the question is compared against earlier questions asked with
+    the same model, settings, system prompt, history and context, and a
+    response is reused if the cosine similarity is at least
+    ``similarity_threshold``.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, persist_path=None,
+                 embedder=None, similarity_threshold=0.95, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.max_disk_entries = max_disk_entries
+
+        # key -> (response, expires_at, scope, latency)
+        self._entries = OrderedDict()
+        # scope -> {"keys": [...], "vectors": [...], "matrix": ndarray or None}
+        self._semantic = {}
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        self._db = None
+        self._disk_writes = 0
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, scope TEXT, response TEXT, "
+                "created REAL, accessed REAL, latency REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model_id, temperature, max_tokens, system_prompt, history, context, user_input):
+        """Return (scope, key) for a request.
+
+        The scope covers everything except the user input and groups
+        requests that can share semantically similar answers.
+        """
+        scope = _hash(json.dumps([
+            model_id, temperature, max_tokens,
+            _hash(system_prompt), hash_messages(history), _hash(context or ""),
+        ]))
+        return scope, _hash(scope + "\n" + user_input)
+
+    def get(self, scope, key, user_input=None):
+        """Return a cached response or None."""
+        now = time.time()
+        with self._lock:
+            response = self._get_memory(key, now)
+            if response is not None:
+                self.exact_hits += 1
+                return response
+
+        response = self._get_disk(key, now)
+        if response is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return response
+
+        if self.embedder is not None and user_input is not None:
+            response = self._get_semantic(scope, user_input, now)
+            if response is not None:
+                with self._lock:
+                    self.semantic_hits += 1
+                return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, scope, key, response, latency=0.0, user_input=None):
+        """Store a response along with the time it took to generate."""
+        now = time.time()
+        with self._lock:
+            self._insert(key, response, now + self.ttl, scope, latency)
+        if self.embedder is not None and user_input is not None:
+            vector = self.embedder.embed([user_input])[0]
+            with self._lock:
+                tier = self._semantic.setdefault(scope, {"keys": [], "vectors": [], "matrix": None})
+                if key in self._entries and key not in tier["keys"]:
+                    tier["keys"].append(key)
+                    tier["vectors"].append(vector)
+                    tier["matrix"] = None
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, scope, response, now, now, latency)
+                )
+                self._disk_writes += 1
+                if self._disk_writes % _PRUNE_INTERVAL == 0:
+                    # Drop the least recently used rows beyond the limit
+                    self._db.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                        "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,)
+                    )
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss counts and the generation time saved by hits."""
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+    def _get_memory(self, key, now):
+        """Exact lookup in memory. Caller must hold the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, expires_at, _, latency = entry
+        if expires_at < now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.saved_seconds += latency
+        return response
+
+    def _get_disk(self, key, now):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT scope, response, created, latency FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            scope, response, created, latency = row
+            if created + self.ttl < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            # Promote to the memory tier
+            self._insert(key, response, created + self.ttl, scope, latency)
+            self.saved_seconds += latency
+            return response
+
+    def _get_semantic(self, scope, user_input, now):
+        with self._lock:
+            tier = self._semantic.get(scope)
+            if not tier or not tier["keys"]:
+                return None
+        query = self.embedder.embed([user_input])[0]
+        with self._lock:
+            tier = self._semantic.get(scope)
+            if not tier or not tier["keys"]:
+                return None
+            if tier["matrix"] is None:
+                tier["matrix"] = np.vstack(tier["vectors"])
+            scores = tier["matrix"] @ query
+            best = int(scores.argmax())
+            if scores[best] < self.similarity_threshold:
+                return None
+            return self._get_memory(tier["keys"][best], now)
+
+    def _insert(self, key, response, expires_at, scope, latency):
+        """Add an entry to the memory tier. Caller must hold the lock."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = (response, expires_at, scope, latency)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key):
+        """Drop an entry and its semantic index slot. Caller must hold the lock."""
+        _, _, scope, _ = self._entries.pop(key)
+        tier = self._semantic.get(scope)
+        if tier and key in tier["keys"]:
+            position = tier["keys"].index(key)
+            del tier["keys"][position]
+            del tier["vectors"][position]
+            tier["matrix"] = None
+            if not tier["keys"]:
+                del self._semantic[scope]
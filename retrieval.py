@@ -0,0 +1,79 @@
+import re
+import math
+import heapq
+from collections import Counter, defaultdict
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    """Lowercase word tokens used for indexing and querying."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+def select_chunks(chunks, pages, chunk_ids, with_pages=False):
+    """The chunks with the given ids, or (chunk, page) pairs with with_pages."""
+    if not with_pages:
+        return [chunks[chunk_id] for chunk_id in chunk_ids]
+    return [(chunks[chunk_id], pages[chunk_id] if pages is not None else None) for chunk_id in chunk_ids]
+
+class ChunkIndex:
+    """BM25 inverted index over the chunks of a single document.
+
+    Built once when a document is processed, then queried on every chat turn
+    so only the chunks relevant to the current question are put into the
+    prompt. ``pages`` optionally gives the (zero-based) page each chunk
+    starts on, so retrieved passages can be cited by page.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75, pages=None):
+        self.chunks = list(chunks)
+        self.pages = list(pages) if pages is not None else None
+        self.k1 = k1
+        self.b = b
+
+        # term -> list of (chunk_id, term frequency)
+        self.postings = defaultdict(list)
+        self.chunk_lengths = []
+        for chunk_id, chunk in enumerate(self.chunks):
+            terms = tokenize(chunk)
+            self.chunk_lengths.append(len(terms))
+            for term, freq in Counter(terms).items():
+                self.postings[term].append((chunk_id, freq))
+
+        total_terms = sum(self.chunk_lengths)
+        self.avg_chunk_length = total_terms / len(self.chunks) if self.chunks else 0.0
+
+        num_chunks = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (num_chunks - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def score(self, query):
+        """Return a dict of chunk_id -> BM25 score for the query."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for chunk_id, freq in posting:
+                length_norm = 1 - self.b + self.b * self.chunk_lengths[chunk_id] / self.avg_chunk_length
+                scores[chunk_id] += idf * freq * (self.k1 + 1) / (freq + self.k1 * length_norm)
+        return scores
+
+    def search(self, query, top_k=4, with_pages=False):
+        """Return the top_k chunks for the query, in document order.
+
+        Falls back to the opening chunks when nothing in the query matches.
+        With with_pages, returns (chunk, page) pairs; page is None when
+        unknown.
+        """
+        scores = self.score(query)
+        if scores:
+            best = heapq.nlargest(top_k, scores, key=scores.get)
+        else:
+            best = range(min(top_k, len(self.chunks)))
+        return select_chunks(self.chunks, self.pages, sorted(best), with_pages)
@@ -0,0 +1,273 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+
+# Requests and tokens per minute assumed for a model without explicit limits
+DEFAULT_REQUESTS_PER_MIN = int(os.environ.get("RATE_LIMIT_RPM", 30))
+DEFAULT_TOKENS_PER_MIN = int(os.environ.get("RATE_LIMIT_TPM", 6000))
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_min``."""
+
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """Seconds until ``amount`` tokens are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self, now):
+        """Empty the bucket, e.g. after the provider reports a rate limit."""
+        self._refill(now)
+        self.tokens = 0.0
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+def is_rate_limit_error(error):
+    """True for HTTP 429 errors from the provider SDK."""
+    return _status_code(error) == 429
+
+def is_retryable_error(error):
+    """True for rate limits, server errors and dropped connections."""
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from the Retry-After header, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class _ModelQueue:
+    def __init__(self, requests_per_min, tokens_per_min):
+        self.requests = TokenBucket(requests_per_min)
+        self.tokens = TokenBucket(tokens_per_min)
+        # (priority, sequence) tickets of waiting callers; lowest goes first
+        self.waiting = []
+        self.max_depth = 0
+
+class RateLimitScheduler:
+    """Schedules LLM calls within per-model request and token limits.
+
+    Each model has a requests/min and a tokens/min bucket. Callers wait in a
+    priority queue (lower priority value goes first, FIFO within a priority)
+    until both buckets can cover the call, so bursts are smoothed out before
+    they reach the provider. Calls that still hit a 429 (or a transient
+    server/connection error) are retried with jittered exponential backoff,
+    honouring Retry-After when present.
+    """
+
+    def __init__(self, limits=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+        # model_id -> (requests_per_min, tokens_per_min)
+        self.limits = limits or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._models = {}
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.wait_seconds = 0.0
+
+    def _queue(self, model_id):
+        queue = self._models.get(model_id)
+        if queue is None:
+            requests_per_min, tokens_per_min = self.limits.get(
+                model_id, (DEFAULT_REQUESTS_PER_MIN, DEFAULT_TOKENS_PER_MIN)
+            )
+            queue = self._models[model_id] = _ModelQueue(requests_per_min, tokens_per_min)
+        return queue
+
+    def tokens_per_minute(self, model_id):
+        """The model's tokens/min limit."""
+        return self.limits.get(model_id, (DEFAULT_REQUESTS_PER_MIN, DEFAULT_TOKENS_PER_MIN))[1]
+
+    def _enqueue(self, model_id, priority):
+        with self._condition:
+            queue = self._queue(model_id)
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(queue.waiting, ticket)
+            queue.max_depth = max(queue.max_depth, len(queue.waiting))
+            return ticket
+
+    def _try_acquire(self, model_id, ticket, tokens):
+        """Take capacity for a queued ticket. Returns 0 on success, else seconds to wait.
+
+        Caller must hold the condition. Tickets behind the head of the queue
+        get None, meaning wait until notified.
+        """
+        queue = self._models[model_id]
+        if queue.waiting[0] != ticket:
+            return None
+        now = time.monotonic()
+        wait = max(queue.requests.wait_time(1, now), queue.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        queue.requests.consume(1)
+        queue.tokens.consume(tokens)
+        heapq.heappop(queue.waiting)
+        self.requests += 1
+        self._condition.notify_all()
+        return 0.0
+
+    def _abandon(self, model_id, ticket):
+        """Remove a ticket whose caller gave up (e.g. was cancelled)."""
+        with self._condition:
+            queue = self._models[model_id]
+            if ticket in queue.waiting:
+                queue.waiting.remove(ticket)
+                heapq.heapify(queue.waiting)
+                self._condition.notify_all()
+
+    def acquire(self, model_id, tokens, priority=0):
+        """Block until the model's buckets can cover one request of ``tokens``."""
+        ticket = self._enqueue(model_id, priority)
+        started_at = time.monotonic()
+        try:
+            with self._condition:
+                while True:
+                    wait = self._try_acquire(model_id, ticket, tokens)
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+                self.wait_seconds += time.monotonic() - started_at
+        except BaseException:
+            self._abandon(model_id, ticket)
+            raise
+
+    async def aacquire(self, model_id, tokens, priority=0, poll_interval=0.05):
+        """Async version of acquire; waits without holding a thread."""
+        ticket = self._enqueue(model_id, priority)
+        started_at = time.monotonic()
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_acquire(model_id, ticket, tokens)
+                    if wait == 0:
+                        self.wait_seconds += time.monotonic() - started_at
+                        return
+                await asyncio.sleep(poll_interval if wait is None else min(wait, 1.0))
+        except BaseException:
+            self._abandon(model_id, ticket)
+            raise
+
+    def _backoff(self, model_id, error, attempt):
+        """Delay before retrying a failed call.
+
+        On a rate limit the model's buckets are drained too, so other
+        callers back off instead of piling on.
+        """
+        with self._condition:
+            self.retries += 1
+            if is_rate_limit_error(error):
+                self.rate_limited += 1
+                queue = self._queue(model_id)
+                now = time.monotonic()
+                queue.requests.drain(now)
+                queue.tokens.drain(now)
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+        return delay
+
+    def run(self, model_id, tokens, call, priority=0):
+        """Run ``call()`` within the model's limits, retrying transient failures."""
+        for attempt in itertools.count():
+            self.acquire(model_id, tokens, priority)
+            try:
+                return call()
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(model_id, e, attempt))
+
+    async def arun(self, model_id, tokens, call, priority=0):
+        """Async version of run; ``call()`` must return an awaitable."""
+        for attempt in itertools.count():
+            await self.aacquire(model_id, tokens, priority)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(model_id, e, attempt))
+
+    async def astream(self, model_id, tokens, call, priority=0):
+        """Run a streaming ``call()`` (returning an async iterator) within the model's limits.
+
+        Retries are only possible until the first chunk arrives; after that
+        errors propagate to the caller. Cancelling the consuming task, even
+        while it waits in the queue, abandons the request.
+        """
+        for attempt in itertools.count():
+            await self.aacquire(model_id, tokens, priority)
+            chunks = call().__aiter__()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(model_id, e, attempt))
+                continue
+            yield first
+            async for chunk in chunks:
+                yield chunk
+            return
+
+    def metrics(self):
+        """Queue depths and retry counters for monitoring."""
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "queue_depth": {model_id: len(queue.waiting) for model_id, queue in self._models.items()},
+                "max_queue_depth": {model_id: queue.max_depth for model_id, queue in self._models.items()},
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """The scheduler shared by every handler in the process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RateLimitScheduler()
+        return _scheduler
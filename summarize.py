@@ -0,0 +1,145 @@
+"""Map-reduce summaries of documents too long to put in context whole.
+
+The text is split with DocumentProcessor.chunk_text and consecutive chunks
+are packed into groups that fit one request, both in the model's context
+window and in a share of its tokens-per-minute limit, so a summary request
+never takes the whole rate budget from chat. Each group is summarized
+(map), then the summaries are packed and summarized again, level by
+level, until one digest is left (reduce). Requests at each level run
+concurrently, up to a limit, through LLMHandler.acomplete, so they share
+the process-wide rate limits with chat.
+
+Digests are cached by a hash of the text, so a document is only
+summarized once however often it is uploaded.
+"""
+import os
+import asyncio
+from client_pool import submit
+from doc_store import DocumentStore
+from message_log import Message, SYSTEM, USER
+from token_budget import estimate_tokens, MESSAGE_OVERHEAD
+from metrics import get_metrics
+
+# Requests in flight at once for one document
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", 4))
+
+# Most tokens (prompt and completion, estimated) one document may spend
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 200000))
+
+# Completion tokens allowed for each summary, including the final digest
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 512))
+
+# Largest share of the model's tokens-per-minute limit one summary request may use
+SUMMARY_RATE_SHARE = float(os.getenv("SUMMARY_RATE_SHARE", 0.5))
+
+# Scheduler priority for summary requests (interactive requests use 0)
+SUMMARY_PRIORITY = 5
+
+MAP_PROMPT = ("Summarize this part of a document. Keep every fact, figure, name, date and conclusion; "
+              "leave out only repetition and filler. Do not add anything that is not in the text.")
+
+REDUCE_PROMPT = ("These are summaries of consecutive parts of one document, in order. Combine them into "
+                 "one summary that follows the document's order. Keep every fact, figure, name, date and "
+                 "conclusion; merge only what is repeated. Do not add anything that is not in the summaries.")
+
+class Summarizer:
+    def __init__(self, handler, processor, store=None, max_concurrency=SUMMARY_CONCURRENCY,
+                 token_budget=SUMMARY_TOKEN_BUDGET, summary_tokens=SUMMARY_MAX_TOKENS, group_tokens=None):
+        self.handler = handler
+        self.processor = processor
+        self.store = store if store is not None else DocumentStore()
+        self.max_concurrency = max_concurrency
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        # Prompt tokens per request; by default whatever the model's window and rate limit leave room for
+        overhead = summary_tokens + estimate_tokens(REDUCE_PROMPT) + 64
+        smallest = 2 * (summary_tokens + MESSAGE_OVERHEAD)
+        if group_tokens is None:
+            window = handler.context_windows.get(handler.current_model, 4096)
+            rate = handler.scheduler.tokens_per_minute(handler.available_models.get(handler.current_model))
+            group_tokens = max(min(window, int(rate * SUMMARY_RATE_SHARE)) - overhead, smallest)
+        self.group_tokens = group_tokens
+        if self.group_tokens < smallest:
+            raise ValueError("Summary requests must have room for at least two summaries")
+
+    def cache_key(self, text):
+        return f"{DocumentStore.hash_content(text.encode('utf-8'))}-{self.summary_tokens}"
+
+    def _pack(self, parts):
+        """Group consecutive parts so each group fits one request."""
+        groups = []
+        group = []
+        used = 0
+        for part in parts:
+            tokens = estimate_tokens(part) + MESSAGE_OVERHEAD
+            if group and used + tokens > self.group_tokens:
+                groups.append(group)
+                group, used = [], 0
+            group.append(part)
+            used += tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    def estimate_cost(self, text, chunks=None):
+        """Rough tokens the whole map-reduce will spend on a text.
+
+        The map reads every chunk once; every summary written is then read
+        again by the level above, and there are fewer than twice as many
+        summaries as map requests. Pass ``chunks`` if the text is already
+        chunked.
+        """
+        if chunks is None:
+            chunks = self.processor.chunk_text(text)
+        requests = len(self._pack(chunks))
+        overhead = estimate_tokens(MAP_PROMPT) + 2 * MESSAGE_OVERHEAD
+        chunk_tokens = sum(estimate_tokens(chunk) + MESSAGE_OVERHEAD for chunk in chunks)
+        return chunk_tokens + 2 * requests * (2 * self.summary_tokens + overhead)
+
+    async def _summarize_group(self, semaphore, prompt, parts, stage):
+        async with semaphore:
+            content = await self.handler.acomplete(
+                [Message(SYSTEM, prompt), Message(USER, "\n\n".join(parts))],
+                temperature=0.0, max_tokens=self.summary_tokens, priority=SUMMARY_PRIORITY
+            )
+        get_metrics().inc("document_summary_requests_total", stage=stage)
+        return content.strip()
+
+    async def asummarize(self, text):
+        """Return a digest of text, summarizing it only if it isn't cached.
+
+        Raises ValueError if the estimated cost is over the token budget.
+        """
+        key = self.cache_key(text)
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached
+
+        # Chunking a long text is CPU work; keep it off the event loop so streams aren't held up
+        chunks = await asyncio.get_running_loop().run_in_executor(None, self.processor.chunk_text, text)
+        cost = self.estimate_cost(text, chunks)
+        if cost > self.token_budget:
+            raise ValueError(f"Summarizing needs about {cost} tokens, over the budget of {self.token_budget}")
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        with get_metrics().span("document_summarize_seconds"):
+            groups = self._pack(chunks)
+            summaries = await asyncio.gather(*(
+                self._summarize_group(semaphore, MAP_PROMPT, group, "map") for group in groups
+            ))
+            while len(summaries) > 1:
+                groups = self._pack(summaries)
+                if len(groups) == len(summaries):
+                    raise ValueError("Summaries are too long to combine within one request")
+                summaries = await asyncio.gather(*(
+                    self._summarize_group(semaphore, REDUCE_PROMPT, group, "reduce") if len(group) > 1
+                    else asyncio.sleep(0, group[0])
+                    for group in groups
+                ))
+        digest = summaries[0]
+        self.store.put(key, digest)
+        return digest
+
+    def summarize(self, text):
+        """Blocking version of asummarize, run on the shared event loop."""
+        return submit(self.asummarize(text)).result()
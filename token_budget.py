@@ -0,0 +1,80 @@
+# Tokens the chat format adds around every message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+# Reserved for the note that replaces trimmed turns
+OMITTED_NOTE_TOKENS = 20
+OMITTED_NOTE = "[{} earlier messages omitted to fit the context window]"
+
+def estimate_tokens(text):
+    """Rough token count for English text (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+class TokenBudget:
+    """Keeps a running token count for a message history and trims it to a budget.
+
+    Each message is counted once when it is first seen; later calls only
+    count messages appended since the previous call. If the history is
+    replaced or shrinks (e.g. after reset_memory) it is recounted.
+
+    Trimming is sticky: once turns have been dropped, the first kept turn
+    only moves when the kept turns no longer fit, and then it moves far
+    enough that they fill just ``refill_ratio`` of the budget. Consecutive
+    requests therefore share the same start of history (and the same
+    prompt prefix) for several turns at a time.
+    """
+
+    def __init__(self, counter=estimate_tokens, refill_ratio=0.75):
+        self.counter = counter
+        self.refill_ratio = refill_ratio
+        self._source = None
+        self._counts = []
+        self._first_kept = 0
+        self.total = 0
+
+    def text_tokens(self, text):
+        """Token count for a message with this text, including format overhead."""
+        return self.counter(text) + MESSAGE_OVERHEAD
+
+    def message_tokens(self, message):
+        """Token count for a single message, including format overhead."""
+        return self.text_tokens(message.content)
+
+    def sync(self, messages):
+        """Count any messages added since the last call."""
+        if messages is not self._source or len(messages) < len(self._counts):
+            self._source = messages
+            self._counts = []
+            self._first_kept = 0
+            self.total = 0
+        for message in messages[len(self._counts):]:
+            tokens = self.message_tokens(message)
+            self._counts.append(tokens)
+            self.total += tokens
+        return self.total
+
+    def fit(self, messages, budget):
+        """Return (omitted, kept): the newest messages that fit within budget tokens.
+
+        The newest message is always kept. Older turns are dropped oldest
+        first; the caller sends OMITTED_NOTE in their place, which is
+        already allowed for in the budget.
+        """
+        total = self.sync(messages)
+        if total <= budget or len(messages) <= 1:
+            self._first_kept = 0
+            return 0, messages
+
+        first_kept = min(self._first_kept, len(messages) - 1)
+        if first_kept and sum(self._counts[first_kept:]) + OMITTED_NOTE_TOKENS <= budget:
+            return first_kept, messages[first_kept:]
+
+        # Walk back from the newest message until the refill target is reached
+        target = budget * self.refill_ratio
+        used = self._counts[-1] + OMITTED_NOTE_TOKENS
+        first_kept = len(messages) - 1
+        while first_kept > 0 and used + self._counts[first_kept - 1] <= target:
+            first_kept -= 1
+            used += self._counts[first_kept]
+
+        self._first_kept = first_kept
+        return first_kept, messages[first_kept:]